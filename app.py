@@ -6,8 +6,39 @@ import os
 import time
 import random
 import re
+import hashlib
+import sqlite3
+import threading
+import functools
+import heapq
+import numpy as np
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Mapping
+import enum
+import logging
+from logging.handlers import RotatingFileHandler
+from dataclasses import dataclass, field
+from typing import Optional
+from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from gtts import gTTS
 import tempfile
+import io
+import copy
+import uuid
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from plan_types import compact_plan
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to atomic replace without cross-process locking
+    fcntl = None
+try:
+    from PIL import Image, ImageOps, features as pil_features
+except ImportError:  # Thumbnails then come from the image host's own resizer
+    Image = None
+
+SCRIPT_STARTED = time.perf_counter()
 
 # --- 1. PAGE CONFIGURATION ---
 st.set_page_config(
@@ -19,6 +50,93 @@ st.set_page_config(
 
 # --- 2. SETUP & CONSTANTS ---
 MEMORY_FILE = "memory.json"
+# Households other than the default one (?household=<name>) keep their own file here
+PROFILES_DIR = "profiles"
+# One JSON line per timed phase; p50/p95 show in the admin panel (?admin=<ADMIN_TOKEN>)
+METRICS_LOG_FILE = "metrics.jsonl"
+METRICS_LOG_MAX_BYTES = 5 * 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+METRICS_WINDOW = 1000
+PLANS_DB_FILE = "meal_plans.db"
+# Days that roll off the window move to an append-only history in the same database;
+# their dishes stay off the menu for NO_REPEAT_DAYS (overridable in secrets)
+NO_REPEAT_DAYS = 14
+# Favorites are exempt from that window and rotate instead, least served first
+FAVORITE_DISHES = ["Bhindi", "Channa", "Rajma", "Beans"]
+FAVORITE_ROTATION_DAYS = 28
+
+CLAUDE_API_URL = "https://api.anthropic.com/v1/messages"
+# Tried in order; override with a CLAUDE_MODELS list in secrets
+CLAUDE_MODELS = ["claude-3-5-haiku-20241022", "claude-3-haiku-20240307"]
+CLAUDE_CONNECT_TIMEOUT = 5
+CLAUDE_READ_TIMEOUT = 25
+CLAUDE_MAX_ATTEMPTS = 3
+CLAUDE_BACKOFF_BASE = 0.6
+CLAUDE_BACKOFF_CAP = 8.0
+# Process-wide budget shared by every session (override CLAUDE_RPM / CLAUDE_TPM in secrets);
+# tightened at runtime from Anthropic's rate-limit headers
+CLAUDE_RPM = 50
+CLAUDE_TPM = 40000
+CLAUDE_QUEUE_TIMEOUT = 30
+# Lower runs first: what the user is looking at outranks background prefetch
+CLAUDE_PRIORITY = {"swap": 0, "menu": 0, "shuffle": 0, "alternatives": 1, "prefetch": 2}
+# Anthropic only caches a system prefix at least this long (in tokens; Haiku needs 2048, larger
+# models 1024). The app's system prompts are 280-430 tokens, so with the default Haiku models
+# prompt caching does not engage; cache_control is only sent once a prompt is long enough.
+PROMPT_CACHE_MIN_TOKENS = {"haiku": 2048}
+PROMPT_CACHE_DEFAULT_MIN_TOKENS = 1024
+
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner']
+# A swap reply is just the replaced meal (plus its ingredients when the dish is not a known one)
+SWAP_MAX_TOKENS = 400
+# Targeted re-asks for a meal that repeats a planned dish or hits a dislike
+MAX_REASKS = 2
+TTS_LANG = 'en'
+TTS_TLD = 'co.in'
+AUDIO_CACHE_DIR = "audio_cache"
+AUDIO_CACHE_MAX_BYTES = 50 * 1024 * 1024
+AUDIO_CACHE_MAX_AGE = 14 * 24 * 3600
+# Card images are fetched once, cut to card size and served from Streamlit's static path
+# (needs server.enableStaticServing, see .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+THUMB_CACHE_DIR = os.path.join(STATIC_DIR, "thumbs")
+THUMB_URL_PREFIX = "app/static/thumbs/"
+THUMB_SIZE = (640, 360)  # 2x the 180 px card image area
+THUMB_QUALITY = 72
+THUMB_CACHE_MAX_BYTES = 30 * 1024 * 1024
+THUMB_CACHE_MAX_AGE = 30 * 24 * 3600
+
+# Generate the rest of the 5-day window in the background once the visible day is ready
+PREFETCH_ENABLED = True
+PREFETCH_WORKERS = 4
+# Plan all missing days in one streamed request; days that fail validation are retried one by one
+PREFETCH_BATCHED = True
+WEEK_MAX_TOKENS_PER_DAY = 450
+# Sessions opening the same day with the same preferences share one generation
+GENERATION_CACHE_TTL = 10 * 60
+GENERATION_CACHE_SIZE = 256
+# Show the local plan if Claude hasn't finished within the deadline (override with
+# HEDGE_DEADLINE_S in secrets), then swap in Claude's plan when it lands
+HEDGE_ENABLED = True
+HEDGE_DEADLINE_S = 8.0
+HEDGE_UPGRADE = True
+# Generation and swaps run as background jobs; the page polls them instead of blocking
+JOB_WORKERS = 8
+# Speculative next-day jobs get their own smaller pool, so they never hold a worker a swap or the
+# visible day is waiting for; opening the day moves a still-queued one over
+JOB_BACKGROUND_WORKERS = 2
+JOB_BACKGROUND_KINDS = {"prefetch"}
+JOB_POLL_S = 1
+JOB_RETENTION_S = 10 * 60
+# Swap alternatives are fetched ahead for the visible day, so a swap click is just a rerun
+SWAP_POOL_ENABLED = True
+SWAP_POOL_SIZE = 3
+SWAP_POOL_REFILL_AT = 1
+SWAP_POOL_DAYS = 64
+SWAP_POOL_MAX_TOKENS = 1200
+# A fill that fails or adds nothing holds that day's refills back, doubling up to the cap
+SWAP_POOL_BACKOFF_BASE = 30.0
+SWAP_POOL_BACKOFF_CAP = 600.0
 
 DEFAULT_PREFERENCES = {
     "dislikes": ["Mix Veg", "Broccoli", "Ghiya", "Bottle Gourd", "Idli", "Dosa", "Thalipeeth"],
@@ -92,6 +210,225 @@ MEAL_IMAGES = {
     "default": "https://images.unsplash.com/photo-1546833998-877b37c2e5c6?w=800"
 }
 
+# Dish -> ingredients, keyed like DISH_IMAGE_MAP. Bump the version when entries change.
+INGREDIENT_CATALOG_VERSION = 2
+DISH_INGREDIENTS = {
+    # Breakfast items
+    "poha": ["Poha", "Onion", "Peanuts", "Green Chilli", "Curry Leaves", "Lemon"],
+    "upma": ["Semolina", "Onion", "Green Chilli", "Curry Leaves", "Mustard Seeds"],
+    "paratha": ["Whole Wheat Flour", "Ghee", "Curd"],
+    "aloo paratha": ["Whole Wheat Flour", "Potato", "Green Chilli", "Coriander", "Ghee", "Curd"],
+    "moong dal cheela": ["Moong Dal", "Ginger", "Green Chilli", "Coriander"],
+    "besan cheela": ["Besan", "Onion", "Tomato", "Green Chilli", "Coriander"],
+    "corn uttapam": ["Fermented Rice Batter", "Sweet Corn", "Onion", "Capsicum"],
+    "uttapam": ["Fermented Rice Batter", "Onion", "Tomato", "Green Chilli"],
+    "masala dosa": ["Fermented Rice Batter", "Potato", "Onion", "Mustard Seeds", "Coconut"],
+    "idli": ["Fermented Rice Batter", "Coconut", "Toor Dal"],
+
+    # Paneer dishes
+    "paneer butter masala": ["Paneer", "Tomato", "Butter", "Cream", "Cashew", "Kasuri Methi"],
+    "paneer tikka": ["Paneer", "Curd", "Capsicum", "Onion", "Lemon"],
+    "palak paneer": ["Paneer", "Spinach", "Onion", "Garlic", "Cream"],
+    "kadai paneer": ["Paneer", "Capsicum", "Onion", "Tomato", "Coriander Seeds"],
+    "paneer bhurji": ["Paneer", "Onion", "Tomato", "Green Chilli"],
+    "matar paneer": ["Paneer", "Green Peas", "Onion", "Tomato"],
+
+    # Dal dishes
+    "chana masala": ["Kabuli Chana", "Onion", "Tomato", "Ginger", "Chana Masala"],
+    "channa masala": ["Kabuli Chana", "Onion", "Tomato", "Ginger", "Chana Masala"],
+    "chole": ["Kabuli Chana", "Onion", "Tomato", "Ginger", "Chole Masala"],
+    "rajma": ["Rajma", "Onion", "Tomato", "Ginger", "Garlic"],
+    "dal tadka": ["Toor Dal", "Onion", "Tomato", "Garlic", "Ghee"],
+    "dal fry": ["Toor Dal", "Onion", "Tomato", "Garlic"],
+    "dal makhani": ["Whole Urad Dal", "Rajma", "Butter", "Cream", "Tomato"],
+
+    # Vegetable curries
+    "bhindi": ["Bhindi", "Onion", "Amchur"],
+    "bhindi masala": ["Bhindi", "Onion", "Tomato", "Amchur"],
+    "aloo gobi": ["Potato", "Cauliflower", "Onion", "Tomato"],
+    "baingan bharta": ["Baingan", "Onion", "Tomato", "Garlic"],
+    "bharta": ["Baingan", "Onion", "Tomato", "Garlic"],
+    "kadhi pakoda": ["Curd", "Besan", "Onion", "Fenugreek Seeds"],
+    "kadhi": ["Curd", "Besan", "Fenugreek Seeds"],
+    "malai kofta": ["Paneer", "Potato", "Cream", "Cashew", "Tomato"],
+    "kofta": ["Potato", "Paneer", "Besan", "Onion", "Tomato"],
+    "green beans": ["French Beans", "Onion", "Garlic"],
+    "beans": ["French Beans", "Onion", "Garlic"],
+    "green beans poriyal": ["French Beans", "Coconut", "Mustard Seeds", "Curry Leaves"],
+    "poriyal": ["Coconut", "Mustard Seeds", "Curry Leaves"],
+    "aloo matar": ["Potato", "Green Peas", "Onion", "Tomato"],
+
+    # Rice dishes
+    "jeera rice": ["Basmati Rice", "Cumin Seeds", "Ghee"],
+    "pulao": ["Basmati Rice", "Green Peas", "Carrot", "Whole Spices"],
+    "veg biryani": ["Basmati Rice", "Mixed Vegetables", "Curd", "Onion", "Biryani Masala"],
+    "biryani": ["Basmati Rice", "Mixed Vegetables", "Curd", "Onion", "Biryani Masala"],
+
+    # Breads
+    "roti": ["Whole Wheat Flour"],
+    "chapati": ["Whole Wheat Flour"],
+    "naan": ["Maida", "Curd", "Butter"],
+    "whole wheat roti": ["Whole Wheat Flour"],
+}
+
+# Ingredient -> (grams in one serving, kcal, protein g, carbs g, fat g per 100 g as bought).
+# Calories and macros are computed from these rather than asked of the model.
+NUTRITION_CATALOG_VERSION = 2
+INGREDIENT_NUTRITION = {
+    # Grains, flours and dals (dry weight)
+    "Basmati Rice": (75, 350, 7.5, 78, 0.6),
+    "Poha": (60, 346, 6.6, 77, 1.2),
+    "Semolina": (50, 360, 12.7, 73, 1.0),
+    "Whole Wheat Flour": (60, 340, 13, 72, 2.5),
+    "Maida": (80, 364, 10, 76, 1.0),
+    "Besan": (40, 387, 22, 58, 6.7),
+    "Fermented Rice Batter": (150, 130, 4, 27, 0.5),
+    "Moong Dal": (50, 347, 24, 63, 1.2),
+    "Toor Dal": (50, 343, 22, 63, 1.5),
+    "Whole Urad Dal": (50, 341, 25, 59, 1.6),
+    "Kabuli Chana": (60, 364, 19, 61, 6.0),
+    "Rajma": (60, 333, 24, 60, 0.8),
+
+    # Dairy, fats and nuts
+    "Paneer": (100, 265, 18, 1.2, 21),
+    "Curd": (100, 60, 3.1, 4.7, 3.3),
+    "Cream": (15, 340, 2.8, 2.8, 36),
+    "Butter": (10, 717, 0.9, 0.1, 81),
+    "Ghee": (7, 900, 0, 0, 100),
+    "Oil": (10, 884, 0, 0, 100),
+    "Cashew": (10, 553, 18, 30, 44),
+    "Peanuts": (10, 567, 26, 16, 49),
+    "Coconut": (15, 354, 3.3, 15, 33),
+
+    # Vegetables
+    "Potato": (100, 77, 2.0, 17, 0.1),
+    "Onion": (40, 40, 1.1, 9.3, 0.1),
+    "Tomato": (60, 18, 0.9, 3.9, 0.2),
+    "Bhindi": (150, 33, 1.9, 7.5, 0.2),
+    "Baingan": (150, 25, 1.0, 6.0, 0.2),
+    "Cauliflower": (120, 25, 1.9, 5.0, 0.3),
+    "Spinach": (150, 23, 2.9, 3.6, 0.4),
+    "French Beans": (120, 31, 1.8, 7.0, 0.2),
+    "Green Peas": (50, 81, 5.4, 14.5, 0.4),
+    "Capsicum": (50, 20, 0.9, 4.6, 0.2),
+    "Carrot": (30, 41, 0.9, 10, 0.2),
+    "Sweet Corn": (40, 86, 3.3, 19, 1.4),
+    "Mixed Vegetables": (100, 50, 2.5, 10, 0.3),
+    "Lemon": (10, 29, 1.1, 9.3, 0.3),
+
+    # Aromatics and spices
+    "Ginger": (5, 80, 1.8, 18, 0.8),
+    "Garlic": (5, 149, 6.4, 33, 0.5),
+    "Green Chilli": (5, 40, 2.0, 9.5, 0.2),
+    "Coriander": (5, 23, 2.1, 3.7, 0.5),
+    "Curry Leaves": (1, 108, 6.0, 18, 1.0),
+    "Kasuri Methi": (1, 323, 23, 58, 6.4),
+    "Fenugreek Seeds": (1, 323, 23, 58, 6.4),
+    "Mustard Seeds": (2, 508, 26, 28, 36),
+    "Cumin Seeds": (2, 375, 18, 44, 22),
+    "Coriander Seeds": (2, 298, 12, 55, 18),
+    "Amchur": (2, 330, 2.0, 80, 0.7),
+    "Chana Masala": (3, 300, 12, 50, 10),
+    "Chole Masala": (3, 300, 12, 50, 10),
+    "Biryani Masala": (3, 300, 12, 50, 10),
+    "Whole Spices": (2, 300, 12, 50, 10),
+}
+
+# Dish -> grams that differ from the per-ingredient serving, keyed like DISH_INGREDIENTS.
+# Cooking oil isn't on the shopping list, so it only appears here.
+DISH_PORTIONS = {
+    "poha": {"Oil": 8},
+    "upma": {"Oil": 8},
+    "paratha": {"Whole Wheat Flour": 80, "Ghee": 10},
+    "aloo paratha": {"Whole Wheat Flour": 80, "Potato": 120, "Ghee": 10},
+    "moong dal cheela": {"Moong Dal": 60, "Oil": 8},
+    "besan cheela": {"Besan": 60, "Oil": 8},
+    "masala dosa": {"Potato": 100, "Oil": 10},
+    "idli": {"Fermented Rice Batter": 200, "Toor Dal": 20, "Coconut": 20},
+    "paneer butter masala": {"Oil": 10},
+    "palak paneer": {"Oil": 10},
+    "kadai paneer": {"Oil": 10},
+    "paneer bhurji": {"Oil": 10},
+    "matar paneer": {"Oil": 10},
+    "chana masala": {"Oil": 8},
+    "channa masala": {"Oil": 8},
+    "chole": {"Oil": 8},
+    "rajma": {"Oil": 8},
+    "dal tadka": {"Ghee": 8},
+    "dal fry": {"Oil": 5},
+    "dal makhani": {"Rajma": 10},
+    "bhindi": {"Oil": 10},
+    "bhindi masala": {"Oil": 10},
+    "aloo gobi": {"Oil": 10},
+    "aloo matar": {"Oil": 10},
+    "baingan bharta": {"Oil": 10},
+    "bharta": {"Oil": 10},
+    "green beans": {"Oil": 8},
+    "beans": {"Oil": 8},
+    "kadhi pakoda": {"Curd": 150, "Besan": 30, "Oil": 12},
+    "kadhi": {"Curd": 150, "Besan": 15},
+    "malai kofta": {"Paneer": 60, "Potato": 60, "Oil": 15},
+    "kofta": {"Paneer": 40, "Potato": 60, "Oil": 15},
+    "pulao": {"Oil": 8},
+    "veg biryani": {"Basmati Rice": 90, "Curd": 30, "Oil": 10},
+    "biryani": {"Basmati Rice": 90, "Curd": 30, "Oil": 10},
+    "naan": {"Maida": 90, "Curd": 15, "Butter": 8},
+}
+
+# Offline planner's recipe book: (dish, desc, tags). Tags: favorite, paneer,
+# weekend (weekend-only treat), south_indian (skipped, as in the chef prompt)
+LOCAL_MENU_CATALOG = {
+    "breakfast": [
+        ("Poha", "Fluffy flattened rice tempered with mustard seeds, curry leaves and crunchy peanuts.", ()),
+        ("Upma", "Savoury semolina cooked with onions, green chillies and a fragrant tempering.", ()),
+        ("Moong Dal Cheela", "Protein-rich lentil pancakes with ginger and fresh coriander.", ()),
+        ("Besan Cheela", "Golden gram flour pancakes studded with onion, tomato and chilli.", ()),
+        ("Paneer Bhurji + Roti", "Soft scrambled paneer with onions and tomatoes, served with warm rotis.", ("paneer",)),
+        ("Aloo Paratha", "Stuffed whole wheat flatbread with spiced potato, served with curd.", ("weekend",)),
+        ("Masala Dosa", "Crisp rice crepe filled with spiced potato masala.", ("south_indian",)),
+        ("Corn Uttapam", "Thick rice pancake topped with sweet corn and onions.", ("south_indian",)),
+    ],
+    "lunch": [
+        ("Rajma + Jeera Rice", "Slow-cooked kidney beans in an onion-tomato gravy with cumin rice.", ("favorite",)),
+        ("Chana Masala + Roti", "Tangy spiced chickpeas with soft whole wheat rotis.", ("favorite",)),
+        ("Bhindi Masala + Roti", "Okra stir-fried with onions, tomatoes and a hint of amchur.", ("favorite",)),
+        ("Green Beans + Dal Fry + Roti", "Garlicky green beans with comforting dal and rotis.", ("favorite",)),
+        ("Dal Tadka + Jeera Rice", "Yellow lentils finished with a smoky ghee tempering, with cumin rice.", ()),
+        ("Aloo Gobi + Roti", "Dry potato and cauliflower with turmeric and cumin.", ()),
+        ("Kadhi Pakoda + Jeera Rice", "Tangy yogurt curry with soft gram flour fritters.", ()),
+        ("Palak Paneer + Roti", "Paneer cubes in a smooth spiced spinach gravy.", ("paneer",)),
+        ("Veg Biryani", "Fragrant layered basmati rice with vegetables and whole spices.", ("weekend",)),
+    ],
+    "dinner": [
+        ("Baingan Bharta + Roti", "Smoky mashed aubergine cooked with onions, tomatoes and garlic.", ()),
+        ("Aloo Matar + Roti", "Homestyle potato and green peas curry.", ()),
+        ("Bhindi + Dal Fry + Roti", "Crisp okra with a simple dal fry and rotis.", ("favorite",)),
+        ("Rajma + Roti", "Hearty kidney bean curry with soft rotis.", ("favorite",)),
+        ("Kadai Paneer + Roti", "Paneer and capsicum tossed in a freshly ground kadai masala.", ("paneer",)),
+        ("Matar Paneer + Roti", "Paneer and green peas in a light onion-tomato gravy.", ("paneer",)),
+        ("Pulao", "Light basmati pulao with peas, carrots and whole spices.", ()),
+        ("Dal Makhani + Naan", "Creamy black lentils simmered overnight, with naan.", ("weekend",)),
+        ("Malai Kofta + Naan", "Paneer-potato dumplings in a rich cashew gravy.", ("weekend", "paneer")),
+    ],
+}
+# Spelling variants and regional names folded to one form before comparing dishes or dislikes
+DISH_SYNONYMS = {
+    "channa": "chana", "chickpea": "chana", "chickpeas": "chana", "chhole": "chole", "chholey": "chole",
+    "daal": "dal", "dhal": "dal", "rajmah": "rajma", "kidney beans": "rajma",
+    "bhendi": "bhindi", "okra": "bhindi", "ladyfinger": "bhindi", "lady finger": "bhindi",
+    "lauki": "bottle gourd", "ghiya": "bottle gourd", "dudhi": "bottle gourd", "doodhi": "bottle gourd",
+    "brinjal": "baingan", "eggplant": "baingan", "aubergine": "baingan",
+    "gobhi": "gobi", "cauliflower": "gobi", "mutter": "matar", "green peas": "matar", "peas": "matar",
+    "spinach": "palak", "potato": "aloo", "potatoes": "aloo", "cottage cheese": "paneer",
+    "parantha": "paratha", "pulav": "pulao", "biriyani": "biryani", "idly": "idli", "uttappam": "uttapam",
+}
+# Folded only in dish names: "Mix Veg" the dish is "Mixed Vegetable Curry", not every dish
+# made with the Mixed Vegetables ingredient (Veg Biryani)
+DISH_NAME_SYNONYMS = {"mixed": "mix", "vegetable": "veg", "vegetables": "veg"}
+# Breads and rice served with a main; any other "+" side (Dal Fry) is a dish of its own
+STAPLE_SIDES = {"roti", "chapati", "phulka", "naan", "paratha", "rice", "jeera rice", "steamed rice"}
+LOCAL_PLAN_MESSAGE = "Chef is running late, so today's plan comes from the house recipe book."
+
 LOADING_MESSAGES = [
     "🥕 Chopping the freshest Bhindi...",
     "🍅 Simmering the Channa Masala...",
@@ -230,6 +567,13 @@ div.stButton > button[kind="primary"] {
     font-weight: 600;
 }
 
+.nutrition-window {
+    margin-top: 10px;
+    font-size: 0.8rem;
+    color: #B2BEC3;
+    font-weight: 600;
+}
+
 /* INGREDIENTS SECTION */
 .ingredients-container {
     background: white;
@@ -309,156 +653,2482 @@ footer {visibility: hidden;}
 """, unsafe_allow_html=True)
 
 # --- 4. HELPER FUNCTIONS ---
+class Metrics:
+    """Durations and outcomes per phase: a rolling window for percentiles plus a rotating JSONL log"""
+
+    def __init__(self, path=METRICS_LOG_FILE, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._outcomes = defaultdict(lambda: defaultdict(int))
+        self._sums = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._log = logging.getLogger(f"ammys_choice.metrics.{id(self)}")
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        try:
+            handler = RotatingFileHandler(path, maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log.addHandler(handler)
+        except OSError:
+            pass
+
+    def observe(self, phase, seconds, outcome="ok", **fields):
+        with self._lock:
+            self._durations[phase].append(seconds)
+            self._outcomes[phase][outcome] += 1
+            self._sums[phase] += seconds
+            self._counts[phase] += 1
+        self._log.info(json.dumps({
+            "ts": round(time.time(), 3), "phase": phase,
+            "ms": round(seconds * 1000, 2), "outcome": outcome, **fields
+        }, default=str))
+
+    @contextlib.contextmanager
+    def timer(self, phase, **fields):
+        """Times the block; the caller may set "outcome" and extra fields on the yielded dict"""
+        record = {"outcome": "ok", **fields}
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            if record["outcome"] == "ok":
+                record["outcome"] = "error"
+            raise
+        except BaseException:
+            # st.rerun unwinds the script with a BaseException: the block was cut short, not broken
+            if record["outcome"] == "ok":
+                record["outcome"] = "rerun"
+            raise
+        finally:
+            self.observe(phase, time.perf_counter() - start, **record)
+
+    def summary(self):
+        rows = []
+        with self._lock:
+            for phase, durations in sorted(self._durations.items()):
+                ordered = sorted(durations)
+                rows.append({
+                    "phase": phase,
+                    "count": self._counts[phase],
+                    "p50_ms": round(ordered[int(0.50 * (len(ordered) - 1))] * 1000, 2),
+                    "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 2),
+                    "outcomes": dict(self._outcomes[phase]),
+                })
+        return rows
+
+    def prometheus_text(self):
+        lines = ["# TYPE ammy_phase_seconds summary"]
+        for row in self.summary():
+            phase = row["phase"]
+            lines.append(f'ammy_phase_seconds{{phase="{phase}",quantile="0.5"}} {row["p50_ms"] / 1000}')
+            lines.append(f'ammy_phase_seconds{{phase="{phase}",quantile="0.95"}} {row["p95_ms"] / 1000}')
+            lines.append(f'ammy_phase_seconds_sum{{phase="{phase}"}} {self._sums[phase]}')
+            lines.append(f'ammy_phase_seconds_count{{phase="{phase}"}} {self._counts[phase]}')
+        lines.append("# TYPE ammy_phase_outcomes_total counter")
+        for row in self.summary():
+            for outcome, count in row["outcomes"].items():
+                lines.append(f'ammy_phase_outcomes_total{{phase="{row["phase"]}",outcome="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+# Same process-wide instance on every rerun, so worker threads can record too
+metrics = get_metrics()
+
+def timed(phase, none_outcome=None):
+    """Record each call's duration under phase; a None result records none_outcome ("miss" for lookups)"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(phase) as record:
+                result = fn(*args, **kwargs)
+                if result is None and none_outcome:
+                    record["outcome"] = none_outcome
+                return result
+        return wrapper
+    return decorate
+
+def rerun(scope="app"):
+    """st.rerun that records the run being cut short; scope="fragment" redraws only the calling fragment"""
+    ctx = get_script_run_ctx()
+    fragment_run = bool(ctx and ctx.fragment_ids_this_run)
+    if scope == "fragment" and not fragment_run:
+        # The fragment is executing as part of a full run, where a fragment rerun isn't allowed
+        scope = "app"
+    if not fragment_run:
+        metrics.observe("script_run", time.perf_counter() - SCRIPT_STARTED, "rerun")
+    st.rerun(scope=scope)
+
+class PreferencesStore:
+    """Per-household preference files with atomic writes, cross-process locks and an mtime-checked cache"""
+
+    def __init__(self, default_path=MEMORY_FILE, profiles_dir=PROFILES_DIR):
+        self.default_path = default_path
+        self.profiles_dir = profiles_dir
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, household):
+        slug = re.sub(r"[^a-z0-9_-]+", "-", (household or "").lower()).strip("-")[:64]
+        if not slug:
+            return self.default_path
+        return os.path.join(self.profiles_dir, f"{slug}.json")
+
+    @contextlib.contextmanager
+    def _file_lock(self, path, exclusive):
+        if fcntl is None:
+            yield
+            return
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _signature(path):
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def _cached(self, path):
+        signature = self._signature(path)
+        if signature is None:
+            return copy.deepcopy(DEFAULT_PREFERENCES)
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached and cached[0] == signature:
+            return copy.deepcopy(cached[1])
+        return None
+
+    def _read_unlocked(self, path):
+        """Read path; the caller holds its file lock (flock on a second descriptor would block on itself)"""
+        prefs = self._cached(path)
+        if prefs is not None:
+            return prefs
+        try:
+            with open(path, "r") as f:
+                prefs = json.load(f)
+        except FileNotFoundError:
+            return copy.deepcopy(DEFAULT_PREFERENCES)
+        except ValueError:
+            prefs = copy.deepcopy(DEFAULT_PREFERENCES)
+        prefs.setdefault("dislikes", [])
+        with self._lock:
+            self._cache[path] = (self._signature(path), prefs)
+        return copy.deepcopy(prefs)
+
+    def _read(self, path):
+        prefs = self._cached(path)
+        if prefs is not None:
+            return prefs
+        with self._file_lock(path, exclusive=False):
+            return self._read_unlocked(path)
+
+    def _write(self, path, prefs):
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(prefs, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._cache[path] = (self._signature(path), copy.deepcopy(prefs))
+
+    def load(self, household=None):
+        return self._read(self.path_for(household))
+
+    def save(self, household, prefs):
+        path = self.path_for(household)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._file_lock(path, exclusive=True):
+            self._write(path, prefs)
+
+    def update(self, household, mutate):
+        """Read-modify-write under the exclusive lock so concurrent sessions keep each other's edits"""
+        path = self.path_for(household)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._file_lock(path, exclusive=True):
+            prefs = self._read_unlocked(path)
+            mutate(prefs)
+            self._write(path, prefs)
+        return copy.deepcopy(prefs)
+
+@st.cache_resource
+def get_preferences_store():
+    return PreferencesStore()
+
 def load_memory():
-    if os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "r") as f:
-            return json.load(f)
-    return DEFAULT_PREFERENCES
+    return get_preferences_store().load(st.session_state.get('household'))
 
-def save_memory(prefs):
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(prefs, f)
+def update_memory(mutate):
+    return get_preferences_store().update(st.session_state.get('household'), mutate)
 
-def text_to_speech(menu_json):
-    date_str = st.session_state.selected_date.strftime("%A, %d %B")
-    speech_text = f"Hello! Here is the menu for {date_str}. "
-    speech_text += f"Breakfast: {menu_json.get('breakfast', {}).get('dish')}. "
-    speech_text += f"Lunch: {menu_json.get('lunch', {}).get('dish')}. "
-    speech_text += f"Dinner: {menu_json.get('dinner', {}).get('dish')}. "
+def preferences_hash(prefs, household=""):
+    """Stable short hash of the preferences that shape a generated menu, scoped to one household.
+
+    The default household keeps the unscoped hash so plans stored before households existed stay visible.
+    """
+    key = {
+        "diet": prefs.get("diet", ""),
+        "dislikes": sorted({d.strip().lower() for d in prefs.get("dislikes", []) if d.strip()}),
+    }
+    if household:
+        key["household"] = household
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class MealPlanStore:
+    """Durable meal plans shared by every session, keyed by date and preference hash.
+
+    Each row also names its household, so the menu history can find the plan a
+    household was served on a day whatever preferences it was planned under.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meal_plans ("
+            " date TEXT NOT NULL,"
+            " prefs_hash TEXT NOT NULL,"
+            " plan TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (date, prefs_hash))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(meal_plans)")}
+        if "household" not in columns:
+            # Stores from before households had their own plans only held the default household's
+            self._conn.execute("ALTER TABLE meal_plans ADD COLUMN household TEXT NOT NULL DEFAULT ''")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS meal_plans_household ON meal_plans (household, date, updated_at)"
+        )
+        self._conn.commit()
+
+    def get_many(self, date_keys, prefs_hash):
+        if not date_keys:
+            return {}
+        placeholders = ",".join("?" * len(date_keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT date, plan FROM meal_plans WHERE prefs_hash = ? AND date IN ({placeholders})",
+                [prefs_hash, *date_keys],
+            ).fetchall()
+        plans = {}
+        for date_key, raw in rows:
+            try:
+                plans[date_key] = json.loads(raw)
+            except ValueError:
+                continue
+        return plans
+
+    def get(self, date_key, prefs_hash):
+        return self.get_many([date_key], prefs_hash).get(date_key)
+
+    def latest_for_household(self, household, date_keys):
+        """The plan last stored for each date by household, under any preference hash"""
+        if not date_keys:
+            return {}
+        placeholders = ",".join("?" * len(date_keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT date, plan FROM meal_plans WHERE household = ? AND date IN ({placeholders})"
+                " ORDER BY updated_at",
+                [household, *date_keys],
+            ).fetchall()
+        plans = {}
+        for date_key, raw in rows:
+            try:
+                plans[date_key] = json.loads(raw)
+            except ValueError:
+                continue
+        return plans
+
+    def put(self, date_key, prefs_hash, plan, household=""):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meal_plans (date, prefs_hash, plan, updated_at, household)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (date_key, prefs_hash, json.dumps(plan, default=dict), time.time(), household or ""),
+            )
+            self._conn.commit()
+
+    def replace_if(self, date_key, prefs_hash, expected, plan):
+        """Store plan only if the stored one is still `expected`; returns whether it did"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT plan FROM meal_plans WHERE date = ? AND prefs_hash = ?", (date_key, prefs_hash)
+            ).fetchone()
+            if row is None or json.loads(row[0]) != expected:
+                return False
+            self._conn.execute(
+                "UPDATE meal_plans SET plan = ?, updated_at = ? WHERE date = ? AND prefs_hash = ?",
+                (json.dumps(plan, default=dict), time.time(), date_key, prefs_hash),
+            )
+            self._conn.commit()
+            return True
+
+@st.cache_resource
+def get_plan_store():
+    return MealPlanStore(PLANS_DB_FILE)
+
+def session_prefs_hash():
+    return preferences_hash(st.session_state.preferences, st.session_state.get('household'))
+
+def load_stored_plans(date_keys):
+    try:
+        return get_plan_store().get_many(date_keys, session_prefs_hash())
+    except sqlite3.Error:
+        return {}
+
+def store_plan(date_key, plan):
+    prefs_hash = session_prefs_hash()
+    # A swap or shuffle supersedes whatever the shared generation cache handed out
+    get_generation_cache().discard((date_key, prefs_hash))
+    try:
+        get_plan_store().put(date_key, prefs_hash, plan, st.session_state.household)
+    except sqlite3.Error:
+        pass
+
+class RecentMenus:
+    """What a household was served before today, as handed to prompts and planners.
+
+    served maps dish identity -> (dish, date) for the no-repeat window; favorites is
+    [(name, times served, last date)] ordered least served, then longest ago, first.
+    """
+
+    def __init__(self, today, days, served, favorites):
+        self.today = today
+        self.days = days
+        self.served = served
+        self.favorites = favorites
+        self.taken = {identity for identity in served if favorite_of(identity) is None}
+
+    def avoid(self):
+        return sorted(self.served[identity][0] for identity in self.taken)
+
+    def days_since(self, identity):
+        if identity not in self.served:
+            return None
+        return (self.today - datetime.date.fromisoformat(self.served[identity][1])).days
+
+    def rotation_weight(self, identity):
+        """Local planner weight: favorites by how overdue they are, other dishes by staleness"""
+        favorite = favorite_of(identity)
+        if favorite is not None:
+            order = [name for name, _, _ in self.favorites]
+            return 2.0 - 1.5 * order.index(favorite) / max(len(order) - 1, 1)
+        days = self.days_since(identity)
+        return 1.0 if days is None else max(days / (self.days + 1), 0.05)
+
+    def prompt_lines(self):
+        lines = [f"Served in the last {self.days} days (do not repeat): {', '.join(self.avoid()) or 'None'}."]
+        due = []
+        for name, count, last in self.favorites:
+            if last is None:
+                due.append(f"{name} (not in the last {FAVORITE_ROTATION_DAYS} days)")
+            else:
+                ago = (self.today - datetime.date.fromisoformat(last)).days
+                due.append(f"{name} ({count}x, last {ago} days ago)")
+        lines.append(f"Favorites due, most overdue first: {', '.join(due)}.")
+        return "\n".join(lines)
+
+def favorite_of(identity):
+    """The FAVORITE_DISHES entry a dish identity belongs to, if any"""
+    for name in FAVORITE_DISHES:
+        if f" {canonical_dish(name)} " in f" {identity} ":
+            return name
+    return None
+
+class MenuHistory:
+    """Append-only record of the menus each household was served, indexed by date and by dish.
+
+    Rows are only ever inserted, once per (household, date, meal), for days already
+    past. Every query is an index range or seek, so it stays cheap as years pile up.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS menu_history ("
+            " household TEXT NOT NULL,"
+            " date TEXT NOT NULL,"
+            " meal_type TEXT NOT NULL,"
+            " dish TEXT NOT NULL,"
+            " identity TEXT NOT NULL,"
+            " favorite TEXT,"
+            " PRIMARY KEY (household, date, meal_type))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS menu_history_identity ON menu_history (household, identity, date)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS menu_history_favorite ON menu_history (household, favorite, date)"
+            " WHERE favorite IS NOT NULL"
+        )
+        self._conn.commit()
+
+    def record(self, household, date_key, plan):
+        rows = []
+        for meal_type in MEAL_TYPES:
+            meal = plan.get(meal_type)
+            if isinstance(meal, dict) and meal.get('dish'):
+                identity = dish_identity(meal['dish'])
+                rows.append((household, date_key, meal_type, meal['dish'], identity, favorite_of(identity)))
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO menu_history VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def recorded_dates(self, household, date_keys):
+        if not date_keys:
+            return set()
+        placeholders = ",".join("?" * len(date_keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT date FROM menu_history WHERE household = ? AND date IN ({placeholders})",
+                [household, *date_keys],
+            ).fetchall()
+        return {date_key for date_key, in rows}
+
+    def served_since(self, household, since):
+        """identity -> (dish, last date) for every dish served on or after since"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT identity, dish, date FROM menu_history WHERE household = ? AND date >= ? ORDER BY date",
+                (household, since),
+            ).fetchall()
+        return {identity: (dish, date_key) for identity, dish, date_key in rows}
+
+    def favorite_stats(self, household, since):
+        """[(favorite, times served since, last date)], least served and longest ago first"""
+        stats = []
+        with self._lock:
+            for name in FAVORITE_DISHES:
+                count, = self._conn.execute(
+                    "SELECT COUNT(*) FROM menu_history WHERE household = ? AND favorite = ? AND date >= ?",
+                    (household, name, since),
+                ).fetchone()
+                last, = self._conn.execute(
+                    "SELECT MAX(date) FROM menu_history WHERE household = ? AND favorite = ?", (household, name)
+                ).fetchone()
+                stats.append((name, count, last))
+        return sorted(stats, key=lambda stat: (stat[1], stat[2] or ""))
+
+    def recent(self, household, today, days):
+        since = str(today - datetime.timedelta(days=days))
+        rotation_since = str(today - datetime.timedelta(days=FAVORITE_ROTATION_DAYS))
+        return RecentMenus(today, days, self.served_since(household, since),
+                           self.favorite_stats(household, rotation_since))
+
+@st.cache_resource
+def get_menu_history():
+    return MenuHistory(PLANS_DB_FILE)
+
+def gtts_synthesize(text, lang, tld):
+    buf = io.BytesIO()
+    gTTS(text=text, lang=lang, tld=tld).write_to_fp(buf)
+    return buf.getvalue()
+
+class DiskCache:
+    """Content-addressed files in one directory with size- and age-bounded LRU eviction"""
+
+    suffixes = ()
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _hit(self, path):
+        try:
+            os.utime(path)  # mtime doubles as last-used time for LRU
+            return True
+        except OSError:
+            return False
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict(keep=path)
+
+    def _evict(self, keep=None):
+        with self._lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(self.suffixes) or entry.path == keep:
+                    continue
+                info = entry.stat()
+                if now - info.st_mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((info.st_mtime, info.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class AudioCache(DiskCache):
+    """MP3 cache for spoken menus.
+
+    synthesize(text, lang, tld) -> bytes is pluggable so a local stub can stand in for gTTS.
+    """
+
+    suffixes = (".mp3",)
+
+    def __init__(self, directory, synthesize=gtts_synthesize, lang=TTS_LANG, tld=TTS_TLD,
+                 max_bytes=AUDIO_CACHE_MAX_BYTES, max_age=AUDIO_CACHE_MAX_AGE):
+        super().__init__(directory, max_bytes, max_age)
+        self.synthesize = synthesize
+        self.lang = lang
+        self.tld = tld
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts")
+
+    def _path(self, text):
+        digest = hashlib.sha256(f"{self.lang}|{self.tld}|{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.mp3")
+
+    def segment(self, text):
+        path = self._path(text)
+        if self._hit(path):
+            with open(path, "rb") as f:
+                return f.read()
+        audio = self.synthesize(text, self.lang, self.tld)
+        self._write(path, audio)
+        return audio
+
+    def render(self, segments):
+        """Path to the audio for the whole message, stitched from per-segment audio"""
+        path = self._path("\n".join(segments))
+        if not self._hit(path):
+            # MP3 frames concatenate cleanly, so recurring dishes are synthesized once
+            self._write(path, b"".join(self.segment(text) for text in segments))
+        return path
+
+    def prerender(self, segments):
+        self._pool.submit(self.render, list(segments))
+
+@st.cache_resource
+def get_audio_cache():
+    return AudioCache(AUDIO_CACHE_DIR)
+
+def fetch_image(source):
+    """Image bytes from an http(s) URL, a file:// URL or a local path"""
+    if source.startswith(("http://", "https://")):
+        response = requests.get(source, timeout=(CLAUDE_CONNECT_TIMEOUT, 15))
+        response.raise_for_status()
+        return response.content
+    with open(source[len("file://"):] if source.startswith("file://") else source, "rb") as f:
+        return f.read()
+
+def resized_remote_url(source, size=THUMB_SIZE, quality=THUMB_QUALITY):
+    """Ask Unsplash's resizer for a card-sized image when there's no local thumbnail yet"""
+    if "images.unsplash.com" not in source:
+        return source
+    base = source.split("?", 1)[0]
+    return f"{base}?w={size[0]}&h={size[1]}&fit=crop&auto=format&q={quality}"
+
+class ImageCache(DiskCache):
+    """Card-sized thumbnails of catalog images, served from Streamlit's static path.
+
+    fetch(source) -> bytes is pluggable, and file:// sources are read from disk,
+    so a local folder can stand in for the image host.
+    """
+
+    suffixes = (".webp", ".jpg")
+
+    def __init__(self, directory, url_prefix, fetch=fetch_image, size=THUMB_SIZE, quality=THUMB_QUALITY,
+                 max_bytes=THUMB_CACHE_MAX_BYTES, max_age=THUMB_CACHE_MAX_AGE):
+        super().__init__(directory, max_bytes, max_age)
+        self.url_prefix = url_prefix
+        self.fetch = fetch
+        self.size = size
+        self.quality = quality
+        self.format = "WEBP" if Image and pil_features.check("webp") else "JPEG"
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbs")
+        self._inflight = set()
+
+    def _name(self, source):
+        digest = hashlib.sha256(f"{self.size}|{self.quality}|{source}".encode("utf-8")).hexdigest()
+        return f"{digest}.{'webp' if self.format == 'WEBP' else 'jpg'}"
+
+    def url_for(self, source):
+        """Local thumbnail URL if ready, else the host's resized image while one is made in the background"""
+        if Image is None or self.url_prefix is None:
+            return resized_remote_url(source, self.size, self.quality)
+        name = self._name(source)
+        if self._hit(os.path.join(self.directory, name)):
+            return self.url_prefix + name
+        self.warm(source)
+        return resized_remote_url(source, self.size, self.quality)
+
+    def warm(self, source):
+        with self._lock:
+            if source in self._inflight:
+                return
+            self._inflight.add(source)
+        self._pool.submit(self._make, source)
+
+    def prewarm(self, sources):
+        for source in dict.fromkeys(sources):
+            self.warm(source)
+
+    def _make(self, source):
+        try:
+            path = os.path.join(self.directory, self._name(source))
+            if self._hit(path):
+                return
+            with Image.open(io.BytesIO(self.fetch(source))) as image:
+                thumb = image.convert("RGB")
+                # Cover-crop to the card's aspect ratio, like object-fit: cover
+                thumb = ImageOps.fit(thumb, self.size, Image.LANCZOS)
+                buf = io.BytesIO()
+                thumb.save(buf, self.format, quality=self.quality)
+            self._write(path, buf.getvalue())
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._inflight.discard(source)
+
+@st.cache_resource
+def get_image_cache():
+    local = Image is not None and st.get_option("server.enableStaticServing")
+    cache = ImageCache(THUMB_CACHE_DIR, THUMB_URL_PREFIX if local else None)
+    if local:
+        cache.prewarm(list(MEAL_IMAGES.values()) + list(DISH_IMAGE_MAP.values()))
+    return cache
+
+def menu_speech_segments(menu_json, day):
+    date_str = day.strftime("%A, %d %B")
+    segments = [f"Hello! Here is the menu for {date_str}."]
+    segments.append(f"Breakfast: {menu_json.get('breakfast', {}).get('dish')}.")
+    segments.append(f"Lunch: {menu_json.get('lunch', {}).get('dish')}.")
+    segments.append(f"Dinner: {menu_json.get('dinner', {}).get('dish')}.")
     if menu_json.get('message'):
-        speech_text += f"Note: {menu_json['message']}"
-    
+        segments.append(f"Note: {menu_json['message']}")
+    return segments
+
+@timed("text_to_speech", none_outcome="error")
+def text_to_speech(menu_json):
+    segments = menu_speech_segments(menu_json, st.session_state.selected_date)
     try:
-        tts = gTTS(text=speech_text, lang='en', tld='co.in')
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-            tts.save(fp.name)
-            return fp.name
-    except:
+        return get_audio_cache().render(segments)
+    except Exception:
         return None
 
-def extract_json(text):
+# Curly quotes standing where JSON's quotes go: right after { [ , : or right before : , } ]
+SMART_QUOTE_DELIMITER_RE = re.compile(r'(?<=[{\[,:])(\s*)[\u201c\u201d]|[\u201c\u201d](?=\s*[:,}\]])')
+TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+def straighten_quotes(text):
+    """Straighten curly quotes used as JSON delimiters; ones inside a value ("Mom’s “special” poha") stay"""
+    return SMART_QUOTE_DELIMITER_RE.sub(lambda m: (m.group(1) or "") + '"', text)
+
+def scan_json_object(text):
+    """Single pass over text for the first top-level object.
+
+    Returns (start, end, closers): end is None when the object never closes,
+    in which case closers is what it would take to close it.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None, None, ""
+    stack = []
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == '{':
+            stack.append('}')
+        elif c == '[':
+            stack.append(']')
+        elif c in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                return start, i + 1, ""
+    return start, None, ('"' if in_string else "") + "".join(reversed(stack))
+
+def _loads(fragment):
     try:
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            return json.loads(match.group())
-        return json.loads(text)
-    except:
+        return json.loads(fragment)
+    except ValueError:
         return None
 
+def repair_json(fragment):
+    """Fix the defects models commonly emit in a complete object: trailing commas"""
+    return _loads(TRAILING_COMMA_RE.sub(r'\1', fragment))
+
+def repair_truncated_json(fragment):
+    """Close an object cut off at max_tokens: back up to the last complete member and close what is open.
+
+    A cut inside a string would keep a half-written value ("Malai Ko"), so those are skipped.
+    """
+    cut = len(fragment)
+    for _ in range(8):
+        data = _close_truncated(fragment[:cut], close_string=False)
+        if data is not None:
+            return data
+        cut = fragment.rfind(',', 0, cut)
+        if cut == -1:
+            break
+    # Nothing complete survived the cut: closing the open string is all that is left
+    return _close_truncated(fragment, close_string=True)
+
+def _close_truncated(candidate, close_string):
+    _, end, closers = scan_json_object(candidate)
+    if end is not None:
+        return None
+    if closers.startswith('"'):
+        if not close_string:
+            return None
+        candidate, closers = candidate + '"', closers[1:]
+    candidate = candidate.rstrip().rstrip(',:').rstrip()
+    return _loads(TRAILING_COMMA_RE.sub(r'\1', candidate + closers))
+
+def _objects(text):
+    """Each top-level object in text in turn, parsed or repaired, or None where it isn't JSON"""
+    offset = 0
+    while True:
+        start, end, _ = scan_json_object(text[offset:])
+        if start is None:
+            return
+        if end is None:
+            # Only an object that never closes was cut off
+            yield repair_truncated_json(text[offset + start:])
+            return
+        fragment = text[offset + start:offset + end]
+        data = _loads(fragment)
+        yield data if data is not None else repair_json(fragment)
+        offset += end
+
+@timed("extract_json", none_outcome="miss")
+def extract_json(text):
+    if not text:
+        return None
+    if '{' not in text:
+        return _loads(text)
+    candidates = [_objects(text)]
+    # Curly quotes used as JSON's quotes throw the scanner's string tracking off, so a
+    # straightened copy is read alongside; each object is tried as written first
+    straightened = straighten_quotes(text)
+    if straightened != text:
+        candidates.append(_objects(straightened))
+    # A complete object that isn't JSON (a "{for Tuesday}" aside in prose) may precede the reply's
+    while candidates:
+        for objects in list(candidates):
+            data = next(objects, StopIteration)
+            if data is StopIteration:
+                candidates.remove(objects)
+            elif data is not None:
+                return data
+    return None
+
+def clean_meal(meal):
+    cleaned = {
+        **meal,
+        'dish': meal['dish'].strip(),
+        'desc': str(meal.get('desc') or 'A delicious and nutritious vegetarian meal.'),
+    }
+    ingredients = meal.get('ingredients')
+    if isinstance(ingredients, list):
+        cleaned['ingredients'] = [str(i) for i in ingredients if i]
+    else:
+        cleaned.pop('ingredients', None)
+    return cleaned
+
+def validate_menu(data):
+    """Coerce a parsed reply into the breakfast/lunch/dinner/message/ingredients shape, or None"""
+    if not isinstance(data, dict):
+        return None
+    menu = {}
+    for meal_type in MEAL_TYPES:
+        meal = data.get(meal_type)
+        if not isinstance(meal, dict) or not isinstance(meal.get('dish'), str) or not meal['dish'].strip():
+            return None
+        menu[meal_type] = clean_meal(meal)
+    message = data.get('message')
+    menu['message'] = message if isinstance(message, str) else ""
+    ingredients = data.get('ingredients')
+    menu['ingredients'] = [str(i) for i in ingredients if i] if isinstance(ingredients, list) else []
+    return menu
+
+def parse_menu(text):
+    return validate_menu(extract_json(text))
+
+class IncrementalJSONParser:
+    """Yields the top-level members of a streamed JSON object as soon as each one is complete"""
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self.done = False
+
+    def feed(self, chunk):
+        members = []
+        if self.done:
+            return members
+        self._text += chunk
+        text = self._text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                continue
+            if self._depth == 0:
+                # Skip any prose before the object
+                if c == '{':
+                    self._depth = 1
+                    self._member_start = i + 1
+                continue
+            if c == '"':
+                self._in_string = True
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    members.extend(self._parse_member(text[self._member_start:i]))
+                    self.done = True
+                    break
+            elif c == ',' and self._depth == 1:
+                members.extend(self._parse_member(text[self._member_start:i]))
+                self._member_start = i + 1
+        self._pos = len(text)
+        return members
+
+    @staticmethod
+    def _parse_member(fragment):
+        if not fragment.strip():
+            return []
+        try:
+            return list(json.loads("{" + fragment + "}").items())
+        except ValueError:
+            return []
+
+def card_html(meal_type, data):
+    dish_name = data.get('dish', 'Food')
+    desc = data.get('desc', 'A delicious and nutritious vegetarian meal.')
+    nutrition = meal_nutrition(data)
+    if nutrition:
+        meta = (f"<span>🔥 {nutrition['kcal']:.0f} kcal</span>"
+                f"<span>P {nutrition['protein']:.0f}g · C {nutrition['carbs']:.0f}g · F {nutrition['fat']:.0f}g</span>")
+    else:
+        # Dishes with nothing on file; plans stored before local nutrition still carry a model estimate
+        meta = f"<span>🔥 {data.get('calories', 'N/A')}</span>"
+    meal_key = meal_type.lower()
+    
+    # Get image from curated mapping or fallback to meal-specific placeholder
+    dish_image = get_food_image(dish_name)
+    final_image_url = get_image_cache().url_for(dish_image or MEAL_IMAGES.get(meal_key, MEAL_IMAGES["default"]))
+    
+    return f"""
+    <div class="food-card">
+        <div class="food-img-container">
+            <img src="{final_image_url}" class="food-img" alt="{meal_type}">
+            <span class="meal-badge">{meal_type}</span>
+        </div>
+        <div class="food-details">
+            <div class="food-title">{dish_name}</div>
+            <div class="food-desc">{desc}</div>
+            <div class="food-meta">
+                {meta}
+                <span>🌿 Veg</span>
+            </div>
+        </div>
+    </div>
+    """
+
+def nutrition_html(day, window, window_days):
+    # A partial total leaves out dishes whose main ingredient isn't on file, so it is a lower bound
+    plus = "+" if day['partial'] else ""
+    pills = [f"🔥 {day['kcal']:,.0f}{plus} kcal", f"Protein {day['protein']:.0f}{plus} g",
+             f"Carbs {day['carbs']:.0f}{plus} g", f"Fat {day['fat']:.0f}{plus} g"]
+    note = ('<div class="nutrition-window">Some dishes aren\'t in the nutrition table yet, '
+            'so these are lower bounds.</div>' if day['partial'] or window['partial'] else "")
+    return f"""
+    <div class="ingredients-container">
+        <div class="ing-header">📊 Nutrition for Today</div>
+        <div>
+            {''.join([f'<span class="pill">{pill}</span>' for pill in pills])}
+        </div>
+        <div class="nutrition-window">{window_days} planned days: {window['kcal']:,.0f}{"+" if window['partial'] else ""} kcal,
+            {window['protein']:.0f} g protein (about {window['kcal'] / window_days:,.0f} kcal a day)</div>
+        {note}
+    </div>
+    """
+
+def ingredients_html(items):
+    return f"""
+    <div class="ingredients-container">
+        <div class="ing-header">🛒 Ingredients for Today</div>
+        <div>
+            {''.join([f'<span class="pill">{item}</span>' for item in items])}
+        </div>
+    </div>
+    """
+
 # ==========================================
 # --- 5. API FUNCTIONS ---
 # ==========================================
-def call_claude_api(prompt_text):
+class ClaudeError(str, enum.Enum):
+    NO_API_KEY = "no_api_key"
+    AUTH = "auth"
+    RATE_LIMITED = "rate_limited"
+    OVERLOADED = "overloaded"
+    TIMEOUT = "timeout"
+    NETWORK = "network"
+    HTTP = "http"
+    BAD_RESPONSE = "bad_response"
+
+@dataclass
+class ClaudeResult:
+    text: Optional[str] = None
+    error: Optional[ClaudeError] = None
+    status: Optional[int] = None
+    model: Optional[str] = None
+    attempts: int = 0
+    usage: dict = field(default_factory=dict)
+
+    @property
+    def ok(self):
+        return self.text is not None
+
+class UsageLedger:
+    """Token usage for recent Claude calls, with running totals per kind of call"""
+
+    FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+    def __init__(self, maxlen=500):
+        self._lock = threading.Lock()
+        self.calls = deque(maxlen=maxlen)
+        self.totals = defaultdict(lambda: dict.fromkeys(("calls",) + self.FIELDS, 0))
+
+    def record(self, kind, result):
+        entry = {"ts": time.time(), "kind": kind, "model": result.model, "ok": result.ok}
+        entry.update({f: int(result.usage.get(f) or 0) for f in self.FIELDS})
+        with self._lock:
+            self.calls.append(entry)
+            totals = self.totals[kind]
+            totals["calls"] += 1
+            for f in self.FIELDS:
+                totals[f] += entry[f]
+
+    def summary(self):
+        with self._lock:
+            return {kind: dict(totals) for kind, totals in self.totals.items()}
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_for(self, amount):
+        """Seconds until amount is available (amounts above capacity only need a full bucket)"""
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0.0) * 60.0 / self.capacity
+
+def prompt_cache_min_tokens(model):
+    return next((n for family, n in PROMPT_CACHE_MIN_TOKENS.items() if family in model),
+                PROMPT_CACHE_DEFAULT_MIN_TOKENS)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets in front of every Claude call.
+
+    Callers queue by priority (then arrival), so a swap the user is waiting on goes
+    ahead of background prefetch. A priority may be a callable, re-read while the
+    caller waits, so background work the user starts waiting on moves up. Rate-limit response headers and 429 Retry-After
+    adjust the budget and pause everyone, instead of each caller finding out alone.
+    """
+
+    def __init__(self, rpm=CLAUDE_RPM, tpm=CLAUDE_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = 0
+
+    def acquire(self, priority, tokens, timeout=CLAUDE_QUEUE_TIMEOUT):
+        """Block until this call may start; False if it waited longer than timeout"""
+        start = time.monotonic()
+        current = priority() if callable(priority) else priority
+        with self._cond:
+            self._seq += 1
+            ticket = (current, self._seq)
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    current = priority() if callable(priority) else priority
+                    if current != ticket[0]:
+                        self._queue.remove(ticket)
+                        ticket = (current, ticket[1])
+                        self._queue.append(ticket)
+                        heapq.heapify(self._queue)
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = max(self.paused_until - now, self.requests.wait_for(1), self.tokens.wait_for(tokens))
+                    if self._queue[0] == ticket and wait <= 0:
+                        self.requests.tokens -= 1
+                        self.tokens.tokens -= min(tokens, self.tokens.capacity)
+                        granted = True
+                        break
+                    remaining = timeout - (now - start)
+                    if remaining <= 0:
+                        granted = False
+                        break
+                    # Not our turn yet: sleep until the buckets refill or another caller leaves the queue
+                    self._cond.wait(min(remaining, wait) if wait > 0 else remaining)
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+        metrics.observe("claude_queue_wait", time.monotonic() - start,
+                        "ok" if granted else "timeout", priority=ticket[0])
+        return granted
+
+    def wake(self):
+        """Have waiting callers look again, e.g. after one's priority changed"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def settle(self, estimated, actual):
+        """Charge the difference once the reply's real token usage is known"""
+        with self._cond:
+            self.tokens.tokens -= actual - estimated
+            self._cond.notify_all()
+
+    def observe(self, response):
+        """Adopt the server's view of our limits and back off everyone on 429/529"""
+        headers = response.headers
+        with self._cond:
+            for bucket, name in ((self.requests, "requests"), (self.tokens, "tokens")):
+                try:
+                    limit = headers.get(f"anthropic-ratelimit-{name}-limit")
+                    remaining = headers.get(f"anthropic-ratelimit-{name}-remaining")
+                    if limit:
+                        bucket.capacity = max(float(limit), 1.0)
+                    if remaining is not None:
+                        bucket.tokens = min(bucket.tokens, float(remaining))
+                except ValueError:
+                    pass
+            if response.status_code in (429, 529):
+                try:
+                    pause = float(headers.get("retry-after") or 0) or CLAUDE_BACKOFF_BASE
+                except ValueError:
+                    pause = CLAUDE_BACKOFF_BASE
+                self.paused_until = max(self.paused_until, time.monotonic() + min(pause, CLAUDE_BACKOFF_CAP * 4))
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                "queue_depth": len(self._queue),
+                "rpm_limit": self.requests.capacity,
+                "rpm_available": round(self.requests.tokens, 1),
+                "tpm_limit": self.tokens.capacity,
+                "tpm_available": round(self.tokens.tokens),
+                "paused_s": round(max(self.paused_until - now, 0.0), 1),
+            }
+
+    def prometheus_text(self):
+        lines = ["# TYPE ammy_claude_limiter gauge"]
+        for name, value in self.snapshot().items():
+            lines.append(f'ammy_claude_limiter{{field="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+class ClaudeClient:
+    """Keep-alive Anthropic client with jittered backoff, Retry-After and model fallback"""
+
+    RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+    def __init__(self, api_key, models=None, url=CLAUDE_API_URL, max_attempts=CLAUDE_MAX_ATTEMPTS,
+                 connect_timeout=CLAUDE_CONNECT_TIMEOUT, read_timeout=CLAUDE_READ_TIMEOUT, limiter=None):
+        self.models = list(models or CLAUDE_MODELS)
+        self.limiter = limiter or RateLimiter()
+        self.url = url
+        self.max_attempts = max_attempts
+        self.timeout = (connect_timeout, read_timeout)
+        self.usage = UsageLedger()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json"
+        })
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), CLAUDE_BACKOFF_CAP)
+            except ValueError:
+                pass
+        # Full jitter keeps concurrent sessions from retrying in lockstep
+        return random.uniform(0, min(CLAUDE_BACKOFF_CAP, CLAUDE_BACKOFF_BASE * (2 ** attempt)))
+
+    def complete(self, prompt_text, max_tokens=1024, on_text=None, system=None, priority=0):
+        """Send one prompt; with on_text, stream the reply and hand each text delta to it"""
+        attempts = 0
+        result = ClaudeResult(error=ClaudeError.HTTP)
+        # Rough input size plus the whole output allowance; corrected from usage afterwards
+        estimate = (len(prompt_text) + len(system or "")) // 4 + max_tokens
+        for model in self.models:
+            payload = {
+                "model": model,
+                "max_tokens": max_tokens,
+                "messages": [{"role": "user", "content": prompt_text}]
+            }
+            if system:
+                block = {"type": "text", "text": system}
+                if len(system) // 4 >= prompt_cache_min_tokens(model):
+                    # Long enough to cache, so repeat calls read the static prefix from cache
+                    block["cache_control"] = {"type": "ephemeral"}
+                payload["system"] = [block]
+            if on_text:
+                payload["stream"] = True
+            for attempt in range(self.max_attempts):
+                if not self.limiter.acquire(priority, estimate):
+                    return ClaudeResult(error=ClaudeError.RATE_LIMITED, model=model, attempts=attempts)
+                attempts += 1
+                response = None
+                try:
+                    response = self.session.post(self.url, json=payload, timeout=self.timeout, stream=bool(on_text))
+                except requests.Timeout:
+                    result = ClaudeResult(error=ClaudeError.TIMEOUT, model=model, attempts=attempts)
+                except requests.RequestException:
+                    result = ClaudeResult(error=ClaudeError.NETWORK, model=model, attempts=attempts)
+                else:
+                    status = response.status_code
+                    self.limiter.observe(response)
+                    if status == 200:
+                        if on_text:
+                            return self._settle(self._read_stream(response, on_text, model, attempts), estimate)
+                        try:
+                            body = response.json()
+                            text = body['content'][0]['text']
+                        except (ValueError, KeyError, IndexError, TypeError):
+                            return ClaudeResult(error=ClaudeError.BAD_RESPONSE, status=status, model=model, attempts=attempts)
+                        return self._settle(ClaudeResult(text=text, status=status, model=model, attempts=attempts,
+                                                         usage=body.get('usage') or {}), estimate)
+                    response.close()
+                    if status in (401, 403):
+                        return ClaudeResult(error=ClaudeError.AUTH, status=status, model=model, attempts=attempts)
+                    error = {429: ClaudeError.RATE_LIMITED, 529: ClaudeError.OVERLOADED}.get(status, ClaudeError.HTTP)
+                    result = ClaudeResult(error=error, status=status, model=model, attempts=attempts)
+                    if status not in self.RETRYABLE_STATUS:
+                        # e.g. unknown model: move on to the next one
+                        break
+                if attempt < self.max_attempts - 1:
+                    time.sleep(self._retry_delay(attempt, response))
+        return result
+
+    def _settle(self, result, estimate):
+        used = sum(int(result.usage.get(f) or 0) for f in
+                   ("input_tokens", "cache_creation_input_tokens", "output_tokens"))
+        if used:
+            self.limiter.settle(estimate, used)
+        return result
+
+    def _read_stream(self, response, on_text, model, attempts):
+        # Text has already reached the UI once deltas flow, so failures here are not retried
+        parts = []
+        usage = {}
+        try:
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[5:])
+                    if event.get("type") == "content_block_delta" and event["delta"].get("type") == "text_delta":
+                        parts.append(event["delta"]["text"])
+                        on_text(event["delta"]["text"])
+                    elif event.get("type") == "error":
+                        overloaded = event.get("error", {}).get("type") == "overloaded_error"
+                        return ClaudeResult(error=ClaudeError.OVERLOADED if overloaded else ClaudeError.HTTP,
+                                            status=200, model=model, attempts=attempts)
+                    elif event.get("type") == "message_start":
+                        usage.update(event.get("message", {}).get("usage") or {})
+                    elif event.get("type") == "message_delta":
+                        usage.update(event.get("usage") or {})
+                    elif event.get("type") == "message_stop":
+                        break
+        except requests.Timeout:
+            return ClaudeResult(error=ClaudeError.TIMEOUT, status=200, model=model, attempts=attempts)
+        except requests.RequestException:
+            return ClaudeResult(error=ClaudeError.NETWORK, status=200, model=model, attempts=attempts)
+        except (ValueError, KeyError, TypeError):
+            return ClaudeResult(error=ClaudeError.BAD_RESPONSE, status=200, model=model, attempts=attempts)
+        return ClaudeResult(text="".join(parts), status=200, model=model, attempts=attempts, usage=usage)
+
+@st.cache_resource
+def get_claude_client(api_key, models, url=CLAUDE_API_URL, rpm=CLAUDE_RPM, tpm=CLAUDE_TPM):
+    # One client, and so one rate limiter, per configuration: every session shares it
+    return ClaudeClient(api_key, models=models, url=url, limiter=RateLimiter(rpm, tpm))
+
+def get_setting(name, default):
+    """Optional override from secrets; a missing secrets file just means the default"""
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
+
+def get_api_client():
     try:
         api_key = st.secrets["CLAUDE_API_KEY"]
-    except:
+    except Exception:
         return None
     
-    url = "https://api.anthropic.com/v1/messages"
-    headers = {
-        "x-api-key": api_key,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
-    payload = {
-        "model": "claude-3-5-haiku-20241022",
-        "max_tokens": 1024,
-        "messages": [{"role": "user", "content": prompt_text}]
-    }
+    models = tuple(get_setting("CLAUDE_MODELS", CLAUDE_MODELS))
+    # CLAUDE_API_URL in secrets points the app at a stand-in (see bench/mock_claude.py)
+    return get_claude_client(api_key, models, get_setting("CLAUDE_API_URL", CLAUDE_API_URL),
+                             int(get_setting("CLAUDE_RPM", CLAUDE_RPM)), int(get_setting("CLAUDE_TPM", CLAUDE_TPM)))
+
+def call_claude_api(prompt_text, client=None, on_text=None, max_tokens=1024, system=None, kind="menu", priority=None):
+    # Worker threads pass their client in; st.secrets is only read on the script thread
+    client = client or get_api_client()
+    if client is None:
+        return ClaudeResult(error=ClaudeError.NO_API_KEY)
+    with metrics.timer("claude_api", kind=kind) as record:
+        result = client.complete(prompt_text, max_tokens=max_tokens, on_text=on_text, system=system,
+                                 priority=CLAUDE_PRIORITY.get(kind, 1) if priority is None else priority)
+        record.update(
+            outcome=result.error.value if result.error else "ok",
+            model=result.model,
+            retries=max(result.attempts - 1, 0),
+            **{f: result.usage.get(f, 0) for f in UsageLedger.FIELDS},
+        )
+    client.usage.record(kind, result)
+    return result
+
+def describe_api_error(result):
+    if result.error in (ClaudeError.RATE_LIMITED, ClaudeError.OVERLOADED):
+        return "Chef is swamped right now. Try again in a minute."
+    if result.error in (ClaudeError.NO_API_KEY, ClaudeError.AUTH):
+        return "Chef's kitchen key is missing or invalid."
+    return "Chef is unreachable."
+
+# --- PROMPT BUILDERS ---
+# The static instructions and schemas go out as system blocks (cacheable once long
+# enough, see PROMPT_CACHE_MIN_TOKENS); only the per-day context (date, dislikes,
+# already-planned dishes) varies between calls
+KNOWN_DISHES = ", ".join(DISH_INGREDIENTS)
+
+MENU_RULES = f"""
+You are an expert Vegetarian Indian Home Chef.
+
+Constraints: Vegetarian. Never use anything the user dislikes. NO South Indian (unless requested).
+
+UNIQUENESS RULE (HIGHEST PRIORITY):
+The user message lists dishes ALREADY planned for this week.
+DO NOT REPEAT ANY DISH FROM THAT LIST.
+
+VARIETY RULES:
+1. PANEER RULE: If "Paneer" is in the 'already planned' list, try to avoid it today unless it's a completely different preparation (e.g. Bhurji vs Butter Masala). prefer alternatives like Soy, Kofta, Rajma.
+2. FAVORITES: Rotate {", ".join(FAVORITE_DISHES)}, preferring those listed first under "Favorites due".
+
+KNOWN DISHES (their ingredients are already on file): {KNOWN_DISHES}.
+"""
+
+MENU_SYSTEM_PROMPT = MENU_RULES + """
+TASK: Generate menu. Add an "ingredients" list to a meal ONLY if its dish is not a KNOWN DISH.
+
+OUTPUT SCHEMA (STRICT JSON):
+{
+  "breakfast": {
+    "dish": "Name",
+    "desc": "Short description",
+    "ingredients": ["Only for dishes not in KNOWN DISHES"]
+  },
+  "lunch": {
+    "dish": "Name",
+    "desc": "Short description"
+  },
+  "dinner": {
+    "dish": "Name",
+    "desc": "Short description"
+  },
+  "message": "Chef's Tip"
+}
+"""
+
+WEEK_SYSTEM_PROMPT = MENU_RULES + """
+TASK: Generate a menu for EVERY day listed in the user message, in the order listed.
+No dish may appear twice across those days either. Add an "ingredients" list to a meal ONLY if its dish is not a KNOWN DISH.
+
+OUTPUT SCHEMA (STRICT JSON), keyed by the ISO date given for each day:
+{
+  "YYYY-MM-DD": {
+    "breakfast": {"dish": "Name", "desc": "Short description"},
+    "lunch": {"dish": "Name", "desc": "Short description"},
+    "dinner": {"dish": "Name", "desc": "Short description"},
+    "message": "Chef's Tip"
+  }
+}
+"""
+
+SWAP_SYSTEM_PROMPT = f"""
+You are a JSON-only API.
+
+TASK:
+Replace ONLY the requested meal with a different vegetarian Indian dish and return just that meal.
+The user is planning a 5-day menu; NEVER repeat a dish listed as already planned. Generate a COMPLETELY NEW option.
+Never use anything the user dislikes.
+Add "ingredients" ONLY if the dish is not one of these KNOWN DISHES: {KNOWN_DISHES}.
+
+OUTPUT SCHEMA (STRICT), keyed by the requested meal type:
+{{
+  "<meal_type>": {{
+    "dish": "Dish Name",
+    "desc": "Short appetizing description (approx 20 words)",
+    "ingredients": ["Only for dishes not in KNOWN DISHES"]
+  }}
+}}
+"""
+
+def history_context(recent):
+    return f"{recent.prompt_lines()}\n" if recent else ""
+
+ALTERNATIVES_SYSTEM_PROMPT = f"""
+You are a JSON-only API.
+
+TASK:
+For EACH requested meal type, suggest several different vegetarian Indian dishes the user could swap in.
+The user is planning a 5-day menu; NEVER repeat a dish listed as already planned, one of today's meals, or another suggestion.
+Never use anything the user dislikes.
+Add "ingredients" ONLY if the dish is not one of these KNOWN DISHES: {KNOWN_DISHES}.
+
+OUTPUT SCHEMA (STRICT), one list per requested meal type:
+{{
+  "<meal_type>": [
+    {{
+      "dish": "Dish Name",
+      "desc": "Short appetizing description (approx 20 words)",
+      "ingredients": ["Only for dishes not in KNOWN DISHES"]
+    }}
+  ]
+}}
+"""
+
+def build_menu_prompt(day, dislikes, planned_dishes, recent=None):
+    is_weekend = day.weekday() >= 5
+    global_context_str = ", ".join(planned_dishes) if planned_dishes else "None"
+    date_display = day.strftime("%A, %d %b")
     
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=25)
-        if response.status_code == 200:
-            return response.json()['content'][0]['text']
-        else:
+    return f"""
+Context: Planning meals for {date_display}. Weekend: {"Yes" if is_weekend else "No"}.
+Dislikes: NO {dislikes}.
+ALREADY planned for this week: {global_context_str}.
+{history_context(recent)}"""
+
+def build_week_prompt(days, dislikes, planned_dishes, recent=None):
+    global_context_str = ", ".join(planned_dishes) if planned_dishes else "None"
+    day_lines = "\n".join(
+        f"- {day.isoformat()}: {day.strftime('%A, %d %b')}. Weekend: {'Yes' if day.weekday() >= 5 else 'No'}."
+        for day in days
+    )
+    
+    return f"""
+Context: Planning meals for these days:
+{day_lines}
+Dislikes: NO {dislikes}.
+ALREADY planned for this week: {global_context_str}.
+{history_context(recent)}"""
+
+def build_swap_prompt(meal_type, current_full_menu, dislikes, planned_dishes, recent=None):
+    global_context_str = ", ".join(planned_dishes)
+    other_meals = ", ".join(
+        f"{m}: {current_full_menu.get(m, {}).get('dish')}" for m in MEAL_TYPES if m != meal_type
+    )
+    
+    return f"""
+Meal to replace: {meal_type} (currently {current_full_menu.get(meal_type, {}).get('dish')}).
+Today's other meals (stay unchanged): {other_meals}.
+ALREADY planned for other days/meals: {global_context_str}.
+Dislikes: NO {dislikes}.
+{history_context(recent)}"""
+
+def build_alternatives_prompt(day, meal_types, current_full_menu, dislikes, planned_dishes, count, recent=None):
+    global_context_str = ", ".join(planned_dishes) if planned_dishes else "None"
+    todays_meals = ", ".join(f"{m}: {current_full_menu.get(m, {}).get('dish')}" for m in MEAL_TYPES)
+    
+    return f"""
+Alternatives wanted: {count} each for {", ".join(meal_types)}.
+Day: {day.strftime("%A, %d %b")}. Weekend: {"Yes" if day.weekday() >= 5 else "No"}.
+Today's meals: {todays_meals}.
+ALREADY planned for other days/meals: {global_context_str}.
+Dislikes: NO {dislikes}.
+{history_context(recent)}"""
+
+def canonical_dish(text):
+    """Lowercase word tokens with DISH_SYNONYMS folded in, so Channa Masala matches Chana Masala"""
+    padded = " " + " ".join(re.findall(r"[a-z0-9]+", str(text).lower())) + " "
+    for variant, canonical in DISH_SYNONYMS.items():
+        if " " in variant:
+            padded = padded.replace(f" {variant} ", f" {canonical} ")
+    return " ".join(DISH_SYNONYMS.get(token, token) for token in padded.split())
+
+def dish_identity(dish):
+    # The main dish decides repeats; "Rajma + Roti" repeats "Rajma + Jeera Rice"
+    return canonical_dish(str(dish).split('+')[0])
+
+def planned_identities(plans):
+    return {
+        dish_identity(p[m]['dish'])
+        for p in plans
+        for m in MEAL_TYPES
+        if isinstance(p.get(m), Mapping) and p[m].get('dish')
+    }
+
+def canonical_dish_name(text):
+    """canonical_dish with DISH_NAME_SYNONYMS folded in too, for comparing against dish names only"""
+    return " ".join(DISH_NAME_SYNONYMS.get(token, token) for token in canonical_dish(text).split())
+
+class DislikeMatcher:
+    """Matches a meal's dish name and ingredients against dislikes, synonyms included"""
+
+    def __init__(self, dislikes):
+        self.terms = [term for term in (canonical_dish(d) for d in dislikes) if term]
+        self.name_terms = [term for term in (canonical_dish_name(d) for d in dislikes) if term]
+
+    def matches(self, meal):
+        name = f" {canonical_dish_name(meal.get('dish', ''))} "
+        if any(f" {term} " in name for term in self.name_terms):
+            return True
+        texts = [canonical_dish(i) for i in meal_ingredients(meal)]
+        return any(f" {term} " in f" {text} " for term in self.terms for text in texts)
+
+class PlannedDishIndex:
+    """Canonical main dish per (date, meal) slot, kept in step with the plans one slot at a time"""
+
+    def __init__(self):
+        self._slots = {}
+        self._counts = {}
+
+    def _add(self, identity, sign):
+        self._counts[identity] = self._counts.get(identity, 0) + sign
+        if self._counts[identity] <= 0:
+            del self._counts[identity]
+
+    def sync(self, plans):
+        live = set()
+        for date_key, plan in plans.items():
+            for meal_type in MEAL_TYPES:
+                meal = plan.get(meal_type)
+                dish = meal.get('dish') if isinstance(meal, Mapping) else None
+                if not dish:
+                    continue
+                slot = (date_key, meal_type)
+                live.add(slot)
+                previous = self._slots.get(slot)
+                if previous and previous[0] == dish:
+                    continue
+                if previous:
+                    self._add(previous[1], -1)
+                identity = dish_identity(dish)
+                self._slots[slot] = (dish, identity)
+                self._add(identity, +1)
+        for slot in set(self._slots) - live:
+            self._add(self._slots.pop(slot)[1], -1)
+
+    def dishes(self):
+        """One name per canonical dish, so "Chana Masala" and "Channa Masala" count once"""
+        names = {}
+        for dish, identity in self._slots.values():
+            names.setdefault(identity, dish)
+        return list(names.values())
+
+    def taken(self, exclude_date=None):
+        """Identities planned on days other than exclude_date"""
+        counts = dict(self._counts)
+        for (date_key, _), (_, identity) in self._slots.items():
+            if date_key == exclude_date:
+                counts[identity] -= 1
+        return {identity for identity, count in counts.items() if count > 0}
+
+def find_violations(menu, taken, matcher, only=None):
+    """Meal types that repeat a planned dish, repeat within the day, or hit a dislike"""
+    bad = []
+    seen = set()
+    for meal_type in MEAL_TYPES:
+        meal = menu.get(meal_type) or {}
+        identity = dish_identity(meal.get('dish', ''))
+        if only is None or meal_type in only:
+            if identity in taken or identity in seen or matcher.matches(meal):
+                bad.append(meal_type)
+        seen.add(identity)
+    return bad
+
+def generate_plan(client, day, dislikes, planned_dishes, recent=None):
+    """Generate one day's menu off the script thread; returns the parsed plan or None"""
+    result = call_claude_api(build_menu_prompt(day, dislikes, planned_dishes, recent), client=client,
+                             system=MENU_SYSTEM_PROMPT, kind="prefetch")
+    return parse_menu(result.text) if result.ok else None
+
+def parse_meal_swap(text, meal_type):
+    """Validate a swap reply: just the new meal object"""
+    data = extract_json(text)
+    if not isinstance(data, dict):
+        return None
+    meal = data.get(meal_type)
+    if not isinstance(meal, dict) or not isinstance(meal.get('dish'), str) or not meal['dish'].strip():
+        return None
+    return clean_meal(meal)
+
+def merge_meal_swap(menu, meal_type, meal):
+    """New menu with only meal_type replaced; the other meals are carried over untouched"""
+    return {**menu, meal_type: meal}
+
+def request_meal_swap(meal_type, menu, dislikes, planned_dishes, client=None, kind="swap", recent=None):
+    """Ask for a replacement meal only; returns (merged menu or None, ClaudeResult)"""
+    prompt = build_swap_prompt(meal_type, menu, dislikes, planned_dishes, recent)
+    result = call_claude_api(prompt, client=client, max_tokens=SWAP_MAX_TOKENS,
+                             system=SWAP_SYSTEM_PROMPT, kind=kind)
+    meal = parse_meal_swap(result.text, meal_type) if result.ok else None
+    return (merge_meal_swap(menu, meal_type, meal) if meal else None), result
+
+def repair_menu(menu, taken, matcher, dislikes, planned_dishes, client=None, only=None, kind="swap", recent=None):
+    """Re-ask only for the offending meals instead of regenerating the whole day"""
+    if recent:
+        taken = taken | recent.taken
+    for _ in range(MAX_REASKS):
+        bad = find_violations(menu, taken, matcher, only)
+        if not bad:
+            break
+        for meal_type in bad:
+            avoid = sorted(set(planned_dishes) | {menu[m]['dish'] for m in MEAL_TYPES if menu.get(m)})
+            new_menu, _ = request_meal_swap(meal_type, menu, dislikes, avoid, client=client, kind=kind,
+                                            recent=recent)
+            if new_menu:
+                menu = new_menu
+    return menu
+
+def plan_local_menu(day, dislikes, planned_dishes, recent=None):
+    """Rule-based menu from LOCAL_MENU_CATALOG in milliseconds; None if a slot can't be filled.
+
+    Recently served dishes are only made less likely, since the catalog is too
+    small to rule out two weeks of them.
+    """
+    rng = random.Random(str(day))
+    is_weekend = day.weekday() >= 5
+    taken = {dish_identity(d) for d in planned_dishes}
+    matcher = DislikeMatcher(dislikes)
+    paneer_planned = any("paneer" in d for d in taken)
+    # Catalog names differ ("Bhindi Masala", "Bhindi + Dal Fry"), so same-day repeats go by base
+    # ingredient, and a side like Dal Fry is served once a day too
+    components = set()
+    menu = {}
+    for meal_type in MEAL_TYPES:
+        options, weights = [], []
+        for dish, desc, tags in LOCAL_MENU_CATALOG[meal_type]:
+            if "south_indian" in tags or ("weekend" in tags and not is_weekend):
+                continue
+            if dish_identity(dish) in taken or day_components(dish) & components or matcher.matches({'dish': dish}):
+                continue
+            weight = recent.rotation_weight(dish_identity(dish)) if recent else 1.0
+            if "favorite" in tags:
+                weight *= 2.5
+            if "weekend" in tags:
+                weight *= 2.0
+            if "paneer" in tags and paneer_planned:
+                # PANEER RULE: only a different preparation, and only reluctantly
+                weight *= 0.2
+            options.append((dish, desc, tags))
+            weights.append(weight)
+        if not options:
             return None
-    except:
+        dish, desc, tags = rng.choices(options, weights=weights)[0]
+        menu[meal_type] = {'dish': dish, 'desc': desc}
+        taken.add(dish_identity(dish))
+        components |= day_components(dish)
+        paneer_planned = paneer_planned or "paneer" in tags
+    menu['message'] = LOCAL_PLAN_MESSAGE
+    menu['source'] = 'local'
+    return menu
+
+class PlanPrefetcher:
+    """Generates missing days in the background, with one in-flight job per date and preference hash.
+
+    With PREFETCH_BATCHED the days come from one streamed request, and each day's
+    future resolves as soon as its object is complete. Days that don't validate
+    fall back to one request each on a bounded pool.
+    """
+
+    def __init__(self, max_workers):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def pending(self, date_key, prefs_hash):
+        with self._lock:
+            return self._inflight.get((date_key, prefs_hash))
+
+    def start(self, client, store, prefs, days, window_keys, recent=None, household=""):
+        """Returns date -> future for every requested day, including ones already in flight"""
+        prefs_hash = preferences_hash(prefs, household)
+        with self._lock:
+            pending = {str(d): self._inflight[(str(d), prefs_hash)] for d in days
+                       if (str(d), prefs_hash) in self._inflight}
+            days = [d for d in days if str(d) not in pending]
+            waiters = {str(d): Future() for d in days}
+            for date_key, waiter in waiters.items():
+                self._inflight[(date_key, prefs_hash)] = waiter
+        if days:
+            threading.Thread(
+                target=self._run,
+                args=(client, store, prefs, prefs_hash, household, days, window_keys, waiters, recent),
+                daemon=True,
+            ).start()
+        return {**pending, **waiters}
+
+    @staticmethod
+    def _planned(store, window_keys, prefs_hash):
+        known = store.get_many(window_keys, prefs_hash)
+        return sorted({p[m]['dish'] for p in known.values() for m in MEAL_TYPES
+                       if isinstance(p.get(m), dict) and p[m].get('dish')})
+
+    def _run_batched(self, client, store, prefs_hash, household, days, window_keys, planned, matcher, dislikes,
+                     waiters, recent):
+        """One request for every day; returns the days still without a plan"""
+        parser = IncrementalJSONParser()
+        wanted = {str(d) for d in days}
+        settled = set()
+        needs_repair = {}
+        served = recent.taken if recent else set()
+
+        def on_text(delta):
+            for date_key, value in parser.feed(delta):
+                if date_key not in wanted or date_key in settled:
+                    continue
+                plan = validate_menu(value)
+                if not plan:
+                    continue
+                others = store.get_many(window_keys, prefs_hash)
+                others.pop(date_key, None)
+                if find_violations(plan, planned_identities(others.values()) | served, matcher):
+                    # Re-asking mid-stream would stall the reply; settle it once the stream ends
+                    needs_repair[date_key] = plan
+                    continue
+                store.put(date_key, prefs_hash, plan, household)
+                settled.add(date_key)
+                waiters[date_key].set_result(plan)
+
+        call_claude_api(build_week_prompt(days, dislikes, planned, recent), client=client, on_text=on_text,
+                        max_tokens=min(WEEK_MAX_TOKENS_PER_DAY * len(days), 4096),
+                        system=WEEK_SYSTEM_PROMPT, kind="prefetch")
+        for date_key, plan in sorted(needs_repair.items()):
+            others = store.get_many(window_keys, prefs_hash)
+            others.pop(date_key, None)
+            plan = repair_menu(plan, planned_identities(others.values()), matcher, dislikes,
+                               self._planned(store, window_keys, prefs_hash), client=client, kind="prefetch",
+                               recent=recent)
+            store.put(date_key, prefs_hash, plan, household)
+            settled.add(date_key)
+            waiters[date_key].set_result(plan)
+        return [d for d in days if str(d) not in settled]
+
+    def _run(self, client, store, prefs, prefs_hash, household, days, window_keys, waiters, recent):
+        dislikes = ", ".join(prefs["dislikes"])
+        matcher = DislikeMatcher(prefs["dislikes"])
+        try:
+            planned = self._planned(store, window_keys, prefs_hash)
+            if PREFETCH_BATCHED and len(days) > 1:
+                days = self._run_batched(client, store, prefs_hash, household, days, window_keys, planned,
+                                         matcher, dislikes, waiters, recent)
+                planned = self._planned(store, window_keys, prefs_hash)
+            futures = {str(d): self._pool.submit(generate_plan, client, d, dislikes, planned, recent) for d in days}
+            # Days were generated blind to each other; settle collisions and dislikes in date order
+            for date_key in sorted(futures):
+                plan = futures[date_key].result()
+                if plan:
+                    others = store.get_many(window_keys, prefs_hash)
+                    others.pop(date_key, None)
+                    plan = repair_menu(plan, planned_identities(others.values()), matcher, dislikes,
+                                       planned, client=client, kind="prefetch", recent=recent)
+                    store.put(date_key, prefs_hash, plan, household)
+                waiters[date_key].set_result(plan)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                for date_key, waiter in waiters.items():
+                    if not waiter.done():
+                        waiter.set_result(None)
+                    self._inflight.pop((date_key, prefs_hash), None)
+
+@st.cache_resource
+def get_prefetcher():
+    return PlanPrefetcher(PREFETCH_WORKERS)
+
+class GenerationCache:
+    """Process-wide plans by (date, preference hash) with TTL and LRU eviction.
+
+    Single-flight: while one session generates a key, other sessions asking for
+    it wait on that call and reuse its result instead of calling Claude again.
+    """
+
+    def __init__(self, ttl=GENERATION_CACHE_TTL, max_entries=GENERATION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, plan = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return plan
+
+    def get_or_generate(self, key, generate):
+        """Cached plan, else the in-flight one, else generate() here; returns a private copy or None"""
+        start = time.perf_counter()
+        with self._lock:
+            plan = self._fresh(key)
+            waiter = self._inflight.get(key) if plan is None else None
+            leader = plan is None and waiter is None
+            if leader:
+                waiter = self._inflight[key] = Future()
+        if plan is not None:
+            metrics.observe("generation_cache", time.perf_counter() - start, "hit")
+            return copy.deepcopy(plan)
+        if not leader:
+            plan = waiter.result()
+            metrics.observe("generation_cache", time.perf_counter() - start, "joined" if plan else "joined_empty")
+            # The leader failed or its run was cut short; generate for this session instead
+            return copy.deepcopy(plan) if plan else generate()
+        plan = None
+        try:
+            plan = generate()
+        finally:
+            # Also reached when a rerun interrupts the leader, so waiters never hang
+            with self._lock:
+                self._inflight.pop(key, None)
+                if plan:
+                    self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(plan))
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            waiter.set_result(plan)
+            metrics.observe("generation_cache", time.perf_counter() - start, "miss")
+        return plan
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+@st.cache_resource
+def get_generation_cache():
+    return GenerationCache()
+
+class SwapPool:
+    """Pre-validated swap alternatives per (date, preference hash) and meal type, shared by sessions.
+
+    One background request tops up every low slot of a day at a time. A swap
+    pops the first alternative that still fits the session's menu, and the next
+    render of the grid refills the slot behind it. A fill that fails or adds
+    nothing backs that day off, so renders don't keep re-asking.
+    """
+
+    def __init__(self, size=SWAP_POOL_SIZE, refill_at=SWAP_POOL_REFILL_AT, max_days=SWAP_POOL_DAYS,
+                 backoff_base=SWAP_POOL_BACKOFF_BASE, backoff_cap=SWAP_POOL_BACKOFF_CAP):
+        self.size = size
+        self.refill_at = refill_at
+        self.max_days = max_days
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="swap-pool")
+        self._lock = threading.Lock()
+        self._slots = OrderedDict()
+        self._filling = set()
+        self._backoff = {}  # key -> (retry not before, last delay)
+
+    def ensure(self, key, fill, *args):
+        """Start fill(meal_types, add, *args) for the slots running low, unless one is under way or backing off"""
+        with self._lock:
+            slots = self._slots.get(key, {})
+            low = [m for m in MEAL_TYPES if len(slots.get(m, ())) <= self.refill_at]
+            if not low or key in self._filling:
+                return
+            if key in self._backoff and time.monotonic() < self._backoff[key][0]:
+                return
+            self._filling.add(key)
+        self._pool.submit(self._fill, key, low, fill, args)
+
+    def _add(self, key, meal_type, meals, added=None):
+        with self._lock:
+            slot = self._slots.setdefault(key, {}).setdefault(meal_type, [])
+            before = len(slot)
+            dishes = {meal['dish'] for meal in slot}
+            slot.extend(meal for meal in meals if meal['dish'] not in dishes)
+            del slot[self.size:]
+            if added is not None:
+                added.append(len(slot) - before)
+            self._slots.move_to_end(key)
+            while len(self._slots) > self.max_days:
+                self._slots.popitem(last=False)
+
+    def _fill(self, key, meal_types, fill, args):
+        added = []
+        try:
+            fill(meal_types, functools.partial(self._add, key, added=added), *args)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._filling.discard(key)
+                if sum(added) > 0:
+                    self._backoff.pop(key, None)
+                else:
+                    delay = min(self._backoff.get(key, (0, self.backoff_base / 2))[1] * 2, self.backoff_cap)
+                    self._backoff[key] = (time.monotonic() + delay, delay)
+                    while len(self._backoff) > self.max_days:
+                        self._backoff.pop(next(iter(self._backoff)))
+
+    def pop(self, key, meal_type, accept):
+        """First pooled alternative accept(meal) passes, or None; rejected ones are dropped"""
+        with self._lock:
+            slot = self._slots.get(key, {}).get(meal_type) or []
+            while slot:
+                meal = slot.pop(0)
+                if accept(meal):
+                    return copy.deepcopy(meal)
         return None
 
+@st.cache_resource
+def get_swap_pool():
+    return SwapPool()
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class JobCancelled(Exception):
+    """Raised inside a job once its session has asked to drop it"""
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    date_key: str
+    meal_type: Optional[str] = None
+    status: JobStatus = JobStatus.QUEUED
+    created: float = field(default_factory=time.monotonic)
+    # When the user started waiting on it: a prefetch only counts once its day is opened
+    waited_since: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+    # Meals parsed so far from a streaming reply, for progressive cards
+    partial: dict = field(default_factory=dict)
+    plan: Optional[dict] = None
+    result: Optional[ClaudeResult] = None
+    # Local plan the session is showing while this job runs past the hedge deadline
+    hedged_plan: Optional[dict] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self):
+        return self.status in (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+class JobQueue:
+    """Background generation jobs by id; sessions poll their status instead of blocking a script run"""
+
+    def __init__(self, max_workers=JOB_WORKERS, background_workers=JOB_BACKGROUND_WORKERS,
+                 retention=JOB_RETENTION_S):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self._background = ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix="jobs-background")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        # fn and args of jobs no worker has started yet
+        self._queued = {}
+        self.retention = retention
+
+    def submit(self, kind, date_key, fn, *args, meal_type=None):
+        """Run fn(job, *args) on the pool; its return value becomes job.plan"""
+        job = Job(id=uuid.uuid4().hex, kind=kind, date_key=date_key, meal_type=meal_type)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+            self._queued[job.id] = (fn, args)
+        pool = self._background if kind in JOB_BACKGROUND_KINDS else self._pool
+        pool.submit(self._run, job)
+        return job
+
+    def promote(self, job, kind):
+        """Someone is now waiting on a background job: if no worker has started it, queue it interactively too"""
+        job.kind = kind
+        job.waited_since = time.monotonic()
+        with self._lock:
+            queued = job.id in self._queued
+        if queued:
+            # Whichever pool reaches it first runs it; the other finds nothing to do
+            self._pool.submit(self._run, job)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Queued jobs never start; running ones stop at their next checkpoint (e.g. the next streamed delta)"""
+        job = self.get(job_id)
+        if job and not job.done:
+            job.cancel_event.set()
+
+    def _run(self, job):
+        with self._lock:
+            task = self._queued.pop(job.id, None)
+        if task is None:
+            return
+        fn, args = task
+        metrics.observe("job_queue_wait", time.monotonic() - job.created, kind=job.kind)
+        start = time.perf_counter()
+        try:
+            job.check_cancelled()
+            job.status = JobStatus.RUNNING
+            job.plan = fn(job, *args)
+            job.status = JobStatus.DONE if job.plan else JobStatus.FAILED
+        except JobCancelled:
+            job.status = JobStatus.CANCELLED
+        except Exception:
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished = time.monotonic()
+            metrics.observe(f"job_{job.kind}", time.perf_counter() - start, job.status.value)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+def run_menu_job(job, client, store, prefs, day, planned_dishes, taken, shared, pending, recent=None, household=""):
+    """Generate one day's menu off the script thread.
+
+    shared joins other sessions' generation of the same day (not for shuffles);
+    pending is a prefetch already under way for it. First plans and hedge
+    upgrades are stored here, so they survive the session leaving.
+    """
+    date_key = str(day)
+    prefs_hash = preferences_hash(prefs, household)
+    dislikes_list = prefs["dislikes"]
+    dislikes = ", ".join(dislikes_list)
+    matcher = DislikeMatcher(dislikes_list)
+
+    def generate():
+        parser = IncrementalJSONParser()
+        def on_text(delta):
+            job.check_cancelled()
+            for key, value in parser.feed(delta):
+                if key in MEAL_TYPES and isinstance(value, dict):
+                    job.partial[key] = value
+        # Priority follows the job's kind while it waits, so a prefetch the user opens moves up
+        job.result = call_claude_api(build_menu_prompt(day, dislikes, planned_dishes, recent), client=client,
+                                     on_text=on_text, system=MENU_SYSTEM_PROMPT, kind=job.kind,
+                                     priority=lambda: CLAUDE_PRIORITY.get(job.kind, 1))
+        job.check_cancelled()
+        plan = parse_menu(job.result.text) if job.result.ok else None
+        if plan and find_violations(plan, taken | (recent.taken if recent else set()), matcher):
+            plan = repair_menu(plan, taken, matcher, dislikes, planned_dishes, client=client, kind=job.kind,
+                               recent=recent)
+        return plan
+
+    plan = pending.result() if pending else None
+    if not plan:
+        plan = shared.get_or_generate((date_key, prefs_hash), generate) if shared else generate()
+    job.check_cancelled()
+    if job.hedged_plan is not None:
+        # Only replace the stand-in if the user hasn't changed it meanwhile
+        if plan:
+            store.replace_if(date_key, prefs_hash, job.hedged_plan, plan)
+        return plan
+    if not plan:
+        plan = plan_local_menu(day, dislikes_list, planned_dishes, recent)
+    if plan and job.kind != "shuffle" and store.get(date_key, prefs_hash) is None:
+        store.put(date_key, prefs_hash, plan, household)
+    return plan
+
+def run_swap_job(job, client, menu, dislikes_list, planned_dishes, taken, recent=None):
+    """Replace job.meal_type in menu; the session merges the new meal into whatever it shows by then"""
+    dislikes = ", ".join(dislikes_list)
+    new_menu, job.result = request_meal_swap(job.meal_type, menu, dislikes, planned_dishes, client=client,
+                                             recent=recent)
+    job.check_cancelled()
+    if new_menu:
+        new_menu = repair_menu(new_menu, taken, DislikeMatcher(dislikes_list), dislikes, planned_dishes,
+                               client=client, only=[job.meal_type], recent=recent)
+    return new_menu
+
+def alternative_fits(meal, meal_type, menu, taken, matcher):
+    """Whether a pooled meal can replace menu[meal_type] without a repeat or a dislike"""
+    others = {dish_identity(menu[m]['dish']) for m in MEAL_TYPES if m != meal_type and isinstance(menu.get(m), Mapping)}
+    current = (menu.get(meal_type) or {}).get('dish')
+    identity = dish_identity(meal['dish'])
+    return (identity not in taken and identity not in others and meal['dish'] != current
+            and not matcher.matches(meal))
+
+def fill_swap_alternatives(meal_types, add, client, day, menu, dislikes_list, planned_dishes, taken, recent=None):
+    """One streamed request for every low slot; each meal type's list is pooled as soon as it is complete"""
+    dislikes = ", ".join(dislikes_list)
+    matcher = DislikeMatcher(dislikes_list)
+    taken = taken | (recent.taken if recent else set()) | planned_identities([menu])
+    parser = IncrementalJSONParser()
+
+    def on_text(delta):
+        for meal_type, value in parser.feed(delta):
+            if meal_type not in meal_types or not isinstance(value, list):
+                continue
+            fresh = []
+            for meal in value:
+                if not isinstance(meal, dict) or not isinstance(meal.get('dish'), str) or not meal['dish'].strip():
+                    continue
+                meal = clean_meal(meal)
+                if alternative_fits(meal, meal_type, menu, taken, matcher):
+                    # Lists arrive in turn, so later ones can't reuse an earlier suggestion
+                    taken.add(dish_identity(meal['dish']))
+                    fresh.append(meal)
+            add(meal_type, fresh)
+
+    prompt = build_alternatives_prompt(day, meal_types, menu, dislikes, planned_dishes, SWAP_POOL_SIZE, recent)
+    call_claude_api(prompt, client=client, on_text=on_text, max_tokens=SWAP_POOL_MAX_TOKENS,
+                    system=ALTERNATIVES_SYSTEM_PROMPT, kind="alternatives")
+
+def catalog_key(dish_name):
+    """Normalize a dish name the way catalog keys are stored: main dish only, lowercase word tokens"""
+    return " ".join(re.findall(r"[a-z0-9]+", str(dish_name).split('+')[0].lower()))
+
+class DishIndex:
+    """Most-specific-match lookup over a dish catalog, independent of catalog size"""
+
+    def __init__(self, mapping, allow_broader=True):
+        self.allow_broader = allow_broader
+        self._entries = {}
+        for key, value in mapping.items():
+            self._entries.setdefault(catalog_key(key), value)
+        self._postings = defaultdict(list)
+        for key in self._entries:
+            for token in set(key.split()):
+                self._postings[token].append(key)
+        self.lookup = functools.lru_cache(maxsize=4096)(self._lookup)
+
+    def _lookup(self, name):
+        if not name:
+            return None
+        if name in self._entries:
+            return self._entries[name]
+        # Longest catalog phrase inside the name, so "green beans poriyal" beats "beans"
+        tokens = name.split()
+        for size in range(len(tokens) - 1, 0, -1):
+            for i in range(len(tokens) - size + 1):
+                phrase = " ".join(tokens[i:i + size])
+                if phrase in self._entries:
+                    return self._entries[phrase]
+        if not self.allow_broader:
+            return None
+        # Otherwise the shortest catalog entry that contains the whole name
+        rarest = min(tokens, key=lambda t: len(self._postings.get(t, ())))
+        padded = f" {name} "
+        matches = [key for key in self._postings.get(rarest, ()) if padded in f" {key} "]
+        if matches:
+            return self._entries[min(matches, key=len)]
+        return None
+
+    def get(self, dish_name):
+        return self.lookup(catalog_key(dish_name))
+
+@st.cache_resource
+def get_image_index():
+    return DishIndex(DISH_IMAGE_MAP)
+
+@st.cache_resource
+def get_ingredient_index(version):
+    # A broader dish's ingredients would be wrong, so only exact or contained matches count
+    return DishIndex(DISH_INGREDIENTS, allow_broader=False)
+
+def dish_ingredients(dish_name):
+    """Catalog ingredients for every part of a dish like "Rajma + Jeera Rice", or None if any part is unknown"""
+    index = get_ingredient_index(INGREDIENT_CATALOG_VERSION)
+    items = []
+    for part in str(dish_name).split('+'):
+        if not part.strip():
+            continue
+        found = index.lookup(catalog_key(part))
+        if found is None:
+            return None
+        items.extend(found)
+    return items or None
+
+def base_ingredient(dish_name):
+    """Main dish's first catalog ingredient ("Bhindi" for Bhindi Masala and Bhindi + Dal Fry alike), or None"""
+    found = get_ingredient_index(INGREDIENT_CATALOG_VERSION).lookup(catalog_key(dish_name))
+    return found[0] if found else None
+
+def day_components(dish_name):
+    """What a dish puts on the day's table: its base ingredient and its non-staple sides ("dal fry")"""
+    components = {catalog_key(part) for part in str(dish_name).split('+')[1:]} - STAPLE_SIDES - {""}
+    base = base_ingredient(dish_name)
+    if base:
+        components.add(base)
+    return components
+
+def meal_ingredients(meal):
+    if not isinstance(meal, Mapping) or not meal.get('dish'):
+        return []
+    return dish_ingredients(meal['dish']) or list(meal.get('ingredients') or [])
+
+def dedupe_ingredients(items):
+    seen = {}
+    for item in items:
+        seen.setdefault(item.strip().lower(), item.strip())
+    return list(seen.values())
+
+def day_ingredients(menu):
+    items = [i for m in MEAL_TYPES for i in meal_ingredients(menu.get(m))]
+    # Plans from before the catalog only carry a day-level list
+    return dedupe_ingredients(items or menu.get('ingredients', []))
+
+class ShoppingList:
+    """Aggregated ingredients across planned days, updated per changed meal rather than rebuilt"""
+
+    def __init__(self):
+        self._meals = {}
+        self._counts = {}
+        self._names = {}
+
+    def _apply(self, items, sign):
+        for item in items:
+            key = item.strip().lower()
+            self._names.setdefault(key, item.strip())
+            self._counts[key] = self._counts.get(key, 0) + sign
+            if self._counts[key] <= 0:
+                del self._counts[key]
+
+    def sync(self, plans):
+        live = set()
+        for date_key, plan in plans.items():
+            for meal_type in MEAL_TYPES:
+                meal = plan.get(meal_type) or {}
+                slot = (date_key, meal_type)
+                signature = (meal.get('dish'), tuple(meal.get('ingredients') or ()))
+                live.add(slot)
+                previous = self._meals.get(slot)
+                if previous and previous[0] == signature:
+                    continue
+                if previous:
+                    self._apply(previous[1], -1)
+                items = dedupe_ingredients(meal_ingredients(meal))
+                self._apply(items, +1)
+                self._meals[slot] = (signature, items)
+        for slot in set(self._meals) - live:
+            self._apply(self._meals.pop(slot)[1], -1)
+
+    def items(self):
+        return [(self._names[key], count) for key, count in sorted(self._counts.items())]
+
+class NutritionEngine:
+    """Calories and macros from INGREDIENT_NUTRITION, totalled locally instead of asked of the model.
+
+    Each meal is a row of grams per ingredient, so a stack of meals times the
+    per-gram table gives every meal's macros in one product, and day or window
+    totals are sums over that array. A meal whose main ingredient isn't on file
+    (Soya Chaap) is uncovered: it gets no number of its own, and totals that
+    include it are flagged partial.
+    """
+
+    MACROS = ("kcal", "protein", "carbs", "fat")
+
+    def __init__(self, nutrition, portions):
+        self._columns = {name.lower(): i for i, name in enumerate(nutrition)}
+        self._serving = np.array([row[0] for row in nutrition.values()], dtype=float)
+        self._per_gram = np.array([row[1:] for row in nutrition.values()], dtype=float) / 100
+        self._portions = DishIndex(portions, allow_broader=False)
+        self._grams = functools.lru_cache(maxsize=4096)(self._meal_grams)
+
+    def _covered(self, part, ingredients):
+        """Whether the listed ingredients a dish is named after ("Soya Chaap" in Soya Chaap Masala) are all on file"""
+        words = set(canonical_dish(part).split())
+        named = [name for name in ingredients if words & set(canonical_dish(name).split())]
+        return bool(named) and all(name.strip().lower() in self._columns for name in named)
+
+    def _meal_grams(self, dish, ingredients):
+        grams = np.zeros(len(self._columns))
+        invented = False
+        covered = True
+        for part in dish.split('+'):
+            if not part.strip():
+                continue
+            portions = self._portions.lookup(catalog_key(part)) or {}
+            names = dish_ingredients(part)
+            if names is None:
+                invented = True
+                covered = covered and self._covered(part, ingredients)
+            for name in [*(names or []), *(n for n in portions if n not in (names or []))]:
+                column = self._columns.get(name.strip().lower())
+                if column is not None:
+                    grams[column] += portions.get(name, self._serving[column])
+        if invented:
+            # Claude's own ingredient list covers the parts the catalog doesn't know, at default servings
+            for name in ingredients:
+                column = self._columns.get(name.strip().lower())
+                if column is not None and not grams[column]:
+                    grams[column] += self._serving[column]
+        grams.flags.writeable = False
+        return grams, covered
+
+    def _rows(self, meals):
+        return [self._grams(str(m.get('dish', '')), tuple(m.get('ingredients') or ()))
+                if isinstance(m, Mapping) else (np.zeros(len(self._columns)), True) for m in meals]
+
+    def grams(self, meals):
+        """(meals, ingredients) grams for a list of meal dicts; unknown meals are all-zero rows"""
+        rows = [grams for grams, _ in self._rows(meals)]
+        return np.stack(rows) if rows else np.zeros((0, len(self._columns)))
+
+    def meal(self, meal):
+        """{macro: value} for one meal, or None if its main ingredients aren't on file"""
+        grams, covered = self._rows([meal])[0]
+        macros = grams @ self._per_gram
+        return dict(zip(self.MACROS, macros.round().tolist())) if covered and macros.any() else None
+
+    def totals(self, plans):
+        """{date: {macro: total, "partial": bool}} per day plus the window total, over every meal at once.
+
+        partial marks a total that leaves out the uncovered part of some meal, so it is a lower bound.
+        """
+        dates = list(plans)
+        rows = self._rows([plans[d].get(m) for d in dates for m in MEAL_TYPES])
+        grams = np.stack([g for g, _ in rows]) if rows else np.zeros((0, len(self._columns)))
+        uncovered = np.array([not c for _, c in rows], dtype=bool).reshape(len(dates), len(MEAL_TYPES)).any(axis=1)
+        per_day = (grams @ self._per_gram).reshape(len(dates), len(MEAL_TYPES), len(self.MACROS)).sum(axis=1)
+        days = {d: {**dict(zip(self.MACROS, row.round().tolist())), "partial": bool(flag)}
+                for d, row, flag in zip(dates, per_day, uncovered)}
+        window = {**dict(zip(self.MACROS, per_day.sum(axis=0).round().tolist())), "partial": bool(uncovered.any())}
+        return days, window
+
+@st.cache_resource
+def get_nutrition_engine(version):
+    return NutritionEngine(INGREDIENT_NUTRITION, DISH_PORTIONS)
+
+def meal_nutrition(meal):
+    return get_nutrition_engine(NUTRITION_CATALOG_VERSION).meal(meal)
+
+@timed("get_food_image", none_outcome="miss")
 def get_food_image(dish_name):
     """Get food image from curated mapping or fallback to meal type"""
     if not dish_name or dish_name == 'Food':
         return None
     
-    # Clean the dish name and convert to lowercase
-    clean_name = dish_name.split('+')[0].strip().lower()
-    
-    # Try exact match first
-    if clean_name in DISH_IMAGE_MAP:
-        return DISH_IMAGE_MAP[clean_name]
-    
-    # Try partial matching for dishes with additional words
-    for key in DISH_IMAGE_MAP:
-        if key in clean_name or clean_name in key:
-            return DISH_IMAGE_MAP[key]
-    
-    # No match found
-    return None
+    return get_image_index().get(dish_name)
 
 # ==========================================
 # --- 6. STATE & DATE LOGIC ---
 # ==========================================
+if 'household' not in st.session_state:
+    st.session_state.household = st.query_params.get("household", "")
+
 if 'preferences' not in st.session_state:
     st.session_state.preferences = load_memory()
 
-if 'meal_plans' not in st.session_state:
-    st.session_state.meal_plans = {}
-
 IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
 today_ist = datetime.datetime.now(IST).date()
 
+def keep_plan(date_key, plan):
+    """Hold plan in the session in its compact form; returns what the session now holds"""
+    st.session_state.meal_plans[date_key] = plan = compact_plan(plan)
+    return plan
+
+if 'meal_plans' not in st.session_state:
+    # Start from whatever other sessions already planned for this window
+    stored = load_stored_plans([str(today_ist + datetime.timedelta(days=i)) for i in range(5)])
+    st.session_state.meal_plans = {date_key: compact_plan(plan) for date_key, plan in stored.items()}
+
 if 'selected_date' not in st.session_state:
     st.session_state.selected_date = today_ist
 
 if st.session_state.selected_date < today_ist:
     st.session_state.selected_date = today_ist
 
+if st.session_state.get('session_day') != today_ist:
+    # A session left open past midnight: earlier days are already in the plan store (and go to
+    # the menu history from there), so they leave the session rather than pile up in it
+    today_key = str(today_ist)
+    for date_key in [k for k in st.session_state.meal_plans if k < today_key]:
+        del st.session_state.meal_plans[date_key]
+    for key in [k for k in st.session_state.get('job_errors', {}) if k[0] < today_key]:
+        del st.session_state.job_errors[key]
+    for key, job_id in list(st.session_state.get('jobs', {}).items()):
+        if key[0] < today_key:
+            get_job_queue().cancel(job_id)
+            del st.session_state.jobs[key]
+    # The window moved: prefetch it again, and let the audio pre-render set start over
+    for stale in ('prefetch_started', 'prefetch_pending', 'audio_prerendered'):
+        st.session_state.pop(stale, None)
+    st.session_state.session_day = today_ist
+
 # --- 7. GLOBAL UNIQUENESS LOGIC ---
+def get_window_plans():
+    # The next 5 days from today, including days prefetched since this session began
+    window_keys = [str(today_ist + datetime.timedelta(days=i)) for i in range(5)]
+    missing = [k for k in window_keys if k not in st.session_state.meal_plans]
+    plans = {**load_stored_plans(missing), **st.session_state.meal_plans}
+    return {k: plans[k] for k in window_keys if k in plans}
+
+def get_planned_index():
+    index = st.session_state.setdefault('planned_index', PlannedDishIndex())
+    index.sync(get_window_plans())
+    return index
+
 def get_all_planned_dishes_5days():
-    all_dishes = []
-    # Check the next 5 days from today
-    for i in range(5):
-        d = today_ist + datetime.timedelta(days=i)
-        d_key = str(d)
-        if d_key in st.session_state.meal_plans:
-            p = st.session_state.meal_plans[d_key]
-            for m in ['breakfast', 'lunch', 'dinner']:
-                if m in p and 'dish' in p[m]:
-                    all_dishes.append(p[m]['dish'])
-    return list(set(filter(None, all_dishes)))
+    return get_planned_index().dishes()
+
+def get_recent_menus():
+    """History before today for this household; days that rolled off are recorded first, once per day"""
+    if st.session_state.get('history_day') != today_ist:
+        days = int(get_setting("NO_REPEAT_DAYS", NO_REPEAT_DAYS))
+        past_keys = [str(today_ist - datetime.timedelta(days=i)) for i in range(1, days + 1)]
+        history = get_menu_history()
+        household = st.session_state.household
+        try:
+            recorded = history.recorded_dates(household, past_keys)
+            # Whatever was served last that day, even under dislikes edited since
+            served = get_plan_store().latest_for_household(household, [k for k in past_keys if k not in recorded])
+            for date_key, plan in served.items():
+                history.record(household, date_key, plan)
+            st.session_state.recent_menus = history.recent(household, today_ist, days)
+        except sqlite3.Error:
+            st.session_state.recent_menus = None
+        st.session_state.history_day = today_ist
+    return st.session_state.recent_menus
 
 # --- SIDEBAR ---
 with st.sidebar:
     st.header("⚙️ Dietary Dislikes")
     
+    # Widget callbacks run before the script, so an edit costs one run instead of run + rerun
+    def add_dislike():
+        new_dislike = st.session_state.new_dislike.strip()
+        if new_dislike and new_dislike not in st.session_state.preferences["dislikes"]:
+            def append(prefs):
+                if new_dislike not in prefs["dislikes"]:
+                    prefs["dislikes"].append(new_dislike)
+            st.session_state.preferences = update_memory(append)
+        st.session_state.new_dislike = ""
+    
+    def remove_dislikes():
+        removed = set(st.session_state.preferences["dislikes"]) - set(st.session_state.dislike_editor)
+        if removed:
+            def drop(prefs):
+                prefs["dislikes"] = [d for d in prefs["dislikes"] if d not in removed]
+            st.session_state.preferences = update_memory(drop)
+    
     col1, col2 = st.columns([3, 1])
     with col1:
-        new_dislike = st.text_input("New item", label_visibility="collapsed", placeholder="E.g. Mushroom")
+        st.text_input("New item", key="new_dislike", label_visibility="collapsed", placeholder="E.g. Mushroom")
     with col2:
-        add_btn = st.button("➕", help="Add to list")
-    
-    if add_btn and new_dislike:
-        if new_dislike not in st.session_state.preferences["dislikes"]:
-            st.session_state.preferences["dislikes"].append(new_dislike)
-            save_memory(st.session_state.preferences)
-            st.rerun()
+        st.button("➕", help="Add to list", on_click=add_dislike)
     
     st.write("---")
     st.write("**Your Dislikes:**")
     st.caption("Click the 'x' to remove an item.")
     
     current_list = st.session_state.preferences["dislikes"]
-    updated_list = st.multiselect("Edit Dislikes", options=current_list, default=current_list, label_visibility="collapsed")
-    
-    if len(updated_list) < len(current_list):
-        st.session_state.preferences["dislikes"] = updated_list
-        save_memory(st.session_state.preferences)
-        st.rerun()
+    # Mirror the stored list into the widget each run so additions show up as selected
+    st.session_state.dislike_editor = list(current_list)
+    st.multiselect("Edit Dislikes", options=current_list, key="dislike_editor",
+                   on_change=remove_dislikes, label_visibility="collapsed")
+
+    admin_token = get_setting("ADMIN_TOKEN", None)
+    if admin_token and st.query_params.get("admin") == admin_token:
+        with st.expander("🛠 Performance"):
+            st.dataframe(
+                [{k: v for k, v in row.items() if k != "outcomes"} for row in metrics.summary()],
+                hide_index=True, use_container_width=True
+            )
+            admin_client = get_api_client()
+            export = metrics.prometheus_text()
+            if admin_client:
+                st.caption("Claude rate limiter (queue wait is the claude_queue_wait row)")
+                st.json(admin_client.limiter.snapshot(), expanded=False)
+                st.caption("Claude token usage by call kind")
+                st.json(admin_client.usage.summary(), expanded=False)
+                export += admin_client.limiter.prometheus_text()
+            st.download_button("Export metrics (Prometheus)", export,
+                               file_name="metrics.prom", mime="text/plain")
 
 # --- MAIN UI ---
 st.markdown("<div class='main-header'><h1>🍳 Ammy's Choice</h1><p>Home-cooked meal planning, made simple.</p></div>", unsafe_allow_html=True)
 
 # DATE SELECTOR
+def select_date(day):
+    st.session_state.selected_date = day
+    # Work for the day being left is no longer wanted (prefetches and hedge upgrades carry on)
+    cancel_session_jobs(keep_date=str(day))
+
 date_cols = st.columns([1,1,1,1,1])
 for i in range(5):
     day_date = today_ist + datetime.timedelta(days=i)
@@ -467,215 +3137,357 @@ for i in range(5):
     btn_type = "primary" if is_selected else "secondary"
     
     with date_cols[i]:
-        if st.button(f"{day_date.strftime('%a')}\n{day_date.strftime('%d')}", 
-                     key=f"btn_{date_key}", 
-                     type=btn_type, 
-                     use_container_width=True):
-            st.session_state.selected_date = day_date
-            st.rerun()
+        st.button(f"{day_date.strftime('%a')}\n{day_date.strftime('%d')}", 
+                  key=f"btn_{date_key}", 
+                  type=btn_type, 
+                  use_container_width=True,
+                  on_click=select_date, args=(day_date,))
 
 st.markdown("<br>", unsafe_allow_html=True)
 
 selected_date_str = str(st.session_state.selected_date)
 current_menu = st.session_state.meal_plans.get(selected_date_str)
 
-action_placeholder = st.empty()
+# --- BACKGROUND JOBS ---
+# Generation never blocks the script: a job runs on the shared queue and the page
+# polls it, so dates and dislikes stay usable meanwhile
+def session_jobs():
+    """(date_key, meal_type or None) -> job id for this session's unfinished work"""
+    return st.session_state.setdefault('jobs', {})
 
-# --- REGENERATION LOGIC (SINGLE MEAL) ---
-def regenerate_single_meal(meal_type, current_full_menu):
-    dislikes = ", ".join(st.session_state.preferences["dislikes"])
-    global_planned_dishes = get_all_planned_dishes_5days()
-    global_context_str = ", ".join(global_planned_dishes)
-    
-    prompt = f"""
-You are a JSON-only API.
+def has_pending_work():
+    return bool(session_jobs() or st.session_state.get('prefetch_pending'))
 
-CONTEXT:
-Current Menu for today: {json.dumps(current_full_menu)}.
+def apply_prefetched_days():
+    """Pick up each background-planned day as soon as it lands; True if the visible day changed"""
+    changed = False
+    pending = st.session_state.get('prefetch_pending') or {}
+    for date_key, future in list(pending.items()):
+        if not future.done():
+            continue
+        del pending[date_key]
+        plan = future.result()
+        if plan and date_key not in st.session_state.meal_plans:
+            keep_plan(date_key, plan)
+            changed = changed or date_key == selected_date_str
+    return changed
 
-GLOBAL CONSTRAINT (CRITICAL):
-The user is planning a 5-day menu. The following dishes are ALREADY planned for other days/meals: {global_context_str}.
-You MUST NOT repeat any of these. Generate a COMPLETELY NEW option.
+def active_job(date_key, meal_type=None):
+    job_id = session_jobs().get((date_key, meal_type))
+    return get_job_queue().get(job_id) if job_id else None
 
-TASK:
-Change ONLY {meal_type} to a different vegetarian Indian dish.
+def cancel_session_jobs(keep_date):
+    jobs = get_job_queue()
+    for (date_key, meal_type), job_id in list(session_jobs().items()):
+        job = jobs.get(job_id)
+        if date_key != keep_date and job and job.kind != "prefetch" and job.hedged_plan is None:
+            jobs.cancel(job_id)
+            del session_jobs()[(date_key, meal_type)]
 
-CONSTRAINTS:
-NO {dislikes}.
-Update 'ingredients'.
+def start_menu_job(kind, day):
+    """Queue generation for day; kind is "menu" (first plan), "shuffle" or "prefetch\""""
+    date_key = str(day)
+    prefs = copy.deepcopy(st.session_state.preferences)
+    pending = get_prefetcher().pending(date_key, session_prefs_hash()) if kind != "shuffle" else None
+    shared = get_generation_cache() if kind != "shuffle" else None
+    job = get_job_queue().submit(kind, date_key, run_menu_job, get_api_client(), get_plan_store(), prefs, day,
+                                 get_all_planned_dishes_5days(), get_planned_index().taken(exclude_date=date_key),
+                                 shared, pending, get_recent_menus(), st.session_state.household)
+    session_jobs()[(date_key, None)] = job.id
+    return job
 
-OUTPUT SCHEMA (STRICT):
-{{
-  "{meal_type}": {{
-    "dish": "Dish Name",
-    "desc": "Short appetizing description (approx 20 words)",
-    "calories": "e.g. 350 kcal"
-  }},
-  "ingredients": ["Updated list..."],
-  "breakfast": {{...keep original...}},
-  "lunch": {{...keep original...}},
-  "dinner": {{...keep original...}},
-  "message": "..."
-}}
-"""
-    
-    with st.spinner(f"🍳 Whipping up a unique {meal_type}..."):
-        text_resp = call_claude_api(prompt)
-        if text_resp:
-            new_data = extract_json(text_resp)
-            if new_data:
-                st.session_state.meal_plans[selected_date_str] = new_data
-                st.cache_data.clear()
-                st.rerun()
-            else:
-                st.error("Chef got confused. Try again.")
-        else:
-            st.error("Chef is unreachable.")
+def promote_prefetch_job(job):
+    """The user opened the day a speculative job is planning: treat it as that day's first plan"""
+    get_job_queue().promote(job, "menu")
+    client = get_api_client()
+    if client:
+        client.limiter.wake()
 
-def generate_menu_ai():
-    dislikes = ", ".join(st.session_state.preferences["dislikes"])
-    is_weekend = st.session_state.selected_date.weekday() >= 5
-    global_planned_dishes = get_all_planned_dishes_5days()
-    global_context_str = ", ".join(global_planned_dishes) if global_planned_dishes else "None"
-    date_display = st.session_state.selected_date.strftime("%A, %d %b")
-    
-    prompt = f"""
-You are an expert Vegetarian Indian Home Chef.
+def start_swap_job(date_key, meal_type):
+    job = get_job_queue().submit("swap", date_key, run_swap_job, get_api_client(),
+                                 st.session_state.meal_plans[date_key],
+                                 list(st.session_state.preferences["dislikes"]), get_all_planned_dishes_5days(),
+                                 get_planned_index().taken(exclude_date=date_key), get_recent_menus(),
+                                 meal_type=meal_type)
+    session_jobs()[(date_key, meal_type)] = job.id
 
-Context: Planning meals for {date_display}. Weekend: {"Yes" if is_weekend else "No"}.
-Constraints: Vegetarian. NO {dislikes}. NO South Indian (unless requested).
+def swap_pool_key(date_key):
+    return (date_key, session_prefs_hash())
 
-UNIQUENESS RULE (HIGHEST PRIORITY):
-The following dishes are ALREADY planned for this week: {global_context_str}.
-DO NOT REPEAT ANY DISH FROM THIS LIST.
+def fill_swap_pool(date_key):
+    """Top up the alternatives for date_key's meals in the background"""
+    client = get_api_client()
+    if not SWAP_POOL_ENABLED or client is None:
+        return
+    get_swap_pool().ensure(swap_pool_key(date_key), fill_swap_alternatives, client,
+                           datetime.date.fromisoformat(date_key), copy.deepcopy(st.session_state.meal_plans[date_key]),
+                           list(st.session_state.preferences["dislikes"]), get_all_planned_dishes_5days(),
+                           get_planned_index().taken(exclude_date=date_key), get_recent_menus())
 
-VARIETY RULES:
-1. PANEER RULE: If "Paneer" is in the 'already planned' list above, try to avoid it today unless it's a completely different preparation (e.g. Bhurji vs Butter Masala). prefer alternatives like Soy, Kofta, Rajma.
-2. FAVORITES: Rotate Bhindi, Channa, Rajma, Beans.
+def swap_from_pool(date_key, meal_type):
+    """Swap in a pooled alternative right away; False if none fits and a swap job is needed"""
+    if not SWAP_POOL_ENABLED:
+        return False
+    start = time.perf_counter()
+    menu = st.session_state.meal_plans[date_key]
+    recent = get_recent_menus()
+    taken = get_planned_index().taken(exclude_date=date_key) | (recent.taken if recent else set())
+    matcher = DislikeMatcher(st.session_state.preferences["dislikes"])
+    meal = get_swap_pool().pop(swap_pool_key(date_key), meal_type,
+                               lambda m: alternative_fits(m, meal_type, menu, taken, matcher))
+    metrics.observe("swap_pool", time.perf_counter() - start, "hit" if meal else "miss")
+    if meal is None:
+        return False
+    plan = keep_plan(date_key, merge_meal_swap(menu, meal_type, meal))
+    store_plan(date_key, plan)
+    return True
 
-TASK: Generate menu & shopping list.
+def apply_finished_jobs():
+    """Move finished job results into the session; True if the visible day changed"""
+    changed = apply_prefetched_days()
+    jobs = get_job_queue()
+    errors = st.session_state.setdefault('job_errors', {})
+    for key, job_id in list(session_jobs().items()):
+        job = jobs.get(job_id)
+        if job is not None and not job.done:
+            continue
+        del session_jobs()[key]
+        if job is None or job.status == JobStatus.CANCELLED:
+            continue
+        date_key, meal_type = key
+        visible = date_key == selected_date_str
+        current = st.session_state.meal_plans.get(date_key)
+        if job.status == JobStatus.FAILED:
+            if job.hedged_plan is None and job.kind != "prefetch":
+                errors[key] = (describe_api_error(job.result) if job.result and not job.result.ok
+                               else "Chef got confused. Try again." if meal_type
+                               else "Chef's handwriting was messy. Try again.")
+                changed = changed or visible
+            continue
+        if meal_type:
+            if not current:
+                continue
+            plan = merge_meal_swap(current, meal_type, job.plan[meal_type])
+        elif job.hedged_plan is not None and current != job.hedged_plan:
+            # The user has edited the stand-in; keep their version
+            continue
+        elif job.kind == "prefetch" and current:
+            continue
+        else:
+            plan = job.plan
+        plan = keep_plan(date_key, plan)
+        if meal_type or job.kind == "shuffle" or job.hedged_plan is not None:
+            store_plan(date_key, plan)
+        changed = changed or visible
+    return changed
 
-OUTPUT SCHEMA (STRICT JSON):
-{{
-  "breakfast": {{
-    "dish": "Name",
-    "desc": "Short description",
-    "calories": "kcal"
-  }},
-  "lunch": {{
-    "dish": "Name",
-    "desc": "Short description",
-    "calories": "kcal"
-  }},
-  "dinner": {{
-    "dish": "Name",
-    "desc": "Short description",
-    "calories": "kcal"
-  }},
-  "message": "Chef's Tip",
-  "ingredients": ["Item 1", "Item 2", "Item 3", "etc..."]
-}}
-"""
-    
-    action_placeholder.empty()
+def show_chef_loading():
     random_msg = random.choice(LOADING_MESSAGES)
+    st.markdown(f"""
+    <div class="chef-loading">
+        <div style="font-size: 3rem;">🥘</div>
+        <div class="chef-loading-text">{random_msg}</div>
+    </div>
+    """, unsafe_allow_html=True)
+
+@st.fragment(run_every=JOB_POLL_S)
+def watch_jobs():
+    """Polls while this session has jobs in flight; redraws the page when one lands"""
+    if apply_finished_jobs() or not has_pending_work():
+        rerun()
+
+@st.fragment(run_every=JOB_POLL_S)
+def generation_progress(date_key):
+    """Chef animation and cards filled in as the streamed menu arrives"""
+    if apply_finished_jobs():
+        rerun()
+    job = active_job(date_key)
+    if job is None:
+        rerun()
+    if (HEDGE_ENABLED and job.kind == "menu" and job.hedged_plan is None
+            and time.monotonic() - job.waited_since > float(get_setting("HEDGE_DEADLINE_S", HEDGE_DEADLINE_S))):
+        # Deadline passed: serve the local plan now and let the job replace it later
+        local_plan = plan_local_menu(datetime.date.fromisoformat(date_key), st.session_state.preferences["dislikes"],
+                                     get_all_planned_dishes_5days(), get_recent_menus())
+        if local_plan:
+            keep_plan(date_key, local_plan)
+            store_plan(date_key, local_plan)
+            if HEDGE_UPGRADE:
+                job.hedged_plan = local_plan
+            else:
+                get_job_queue().cancel(job.id)
+                session_jobs().pop((date_key, None), None)
+            rerun()
     
-    with action_placeholder.container():
-        st.markdown(f"""
-        <div class="chef-loading">
-            <div style="font-size: 3rem;">🥘</div>
-            <div class="chef-loading-text">{random_msg}</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    text_resp = call_claude_api(prompt)
-    action_placeholder.empty()
+    show_chef_loading()
+    partial = dict(job.partial)
+    cols = st.columns(3, gap="medium")
+    for meal_type, col in zip(MEAL_TYPES, cols):
+        if meal_type in partial:
+            col.markdown(card_html(meal_type.capitalize(), partial[meal_type]), unsafe_allow_html=True)
+    if partial:
+        st.markdown(ingredients_html(day_ingredients(partial)), unsafe_allow_html=True)
+    if job.kind == "shuffle" and st.button("✖ Keep current menu", use_container_width=True):
+        get_job_queue().cancel(job.id)
+        session_jobs().pop((date_key, None), None)
+        rerun()
+
+# --- MENU FRAGMENTS ---
+# Swaps and audio rerun only their own fragment, not the page (CSS, date bar, sidebar).
+# Derived state is keyed by date and meal: PlannedDishIndex, ShoppingList and the
+# ingredient lookups only recompute entries whose meal changed.
+@timed("render_card")
+def render_card_with_action(col, date_key, meal_type, data):
+    with col:
+        meal_key = meal_type.lower()
+        swap_job = active_job(date_key, meal_key)
+        if swap_job:
+            st.markdown(f'<div style="opacity: 0.45;">{card_html(meal_type, data)}</div>', unsafe_allow_html=True)
+            if st.button(f"✖ Cancel {meal_type} swap", key=f"cancel_{meal_key}", use_container_width=True):
+                get_job_queue().cancel(swap_job.id)
+                session_jobs().pop((date_key, meal_key), None)
+                rerun(scope="fragment")
+        else:
+            st.markdown(card_html(meal_type, data), unsafe_allow_html=True)
+            if st.button(f"🔄 Swap {meal_type}", key=f"swap_{meal_key}", use_container_width=True):
+                if not swap_from_pool(date_key, meal_key):
+                    start_swap_job(date_key, meal_key)
+                rerun(scope="fragment")
+        error = st.session_state.get('job_errors', {}).pop((date_key, meal_key), None)
+        if error:
+            st.error(error)
+
+@st.fragment
+@timed("menu_grid")
+def menu_grid(date_key):
+    current_menu = st.session_state.meal_plans[date_key]
     
-    if text_resp:
-        data = extract_json(text_resp)
-        if data:
-            return data
+    # --- AUDIO PRE-RENDER ---
+    # Synthesize in the background so "Share Menu as Audio" is a cache hit
+    speech_segments = menu_speech_segments(current_menu, datetime.date.fromisoformat(date_key))
+    speech_key = hashlib.sha256("\n".join(speech_segments).encode("utf-8")).hexdigest()
+    prerendered = st.session_state.setdefault('audio_prerendered', set())
+    if speech_key not in prerendered:
+        prerendered.add(speech_key)
+        get_audio_cache().prerender(speech_segments)
     
-    st.error("Chef's handwriting was messy. Try again.")
-    return None
-
-# --- AUTO-GENERATION LOGIC (NO BUTTON) ---
-if not current_menu:
-    # Trigger generation automatically if menu is missing
-    menu_data = generate_menu_ai()
-    if menu_data:
-        st.session_state.meal_plans[selected_date_str] = menu_data
-        st.rerun()
-else:
     # --- RENDER MENU GRID ---
     c1, c2, c3 = st.columns(3, gap="medium")
+    render_card_with_action(c1, date_key, "Breakfast", current_menu.get('breakfast', {}))
+    render_card_with_action(c2, date_key, "Lunch", current_menu.get('lunch', {}))
+    render_card_with_action(c3, date_key, "Dinner", current_menu.get('dinner', {}))
     
-    def render_card_with_action(col, meal_type, data):
-        with col:
-            dish_name = data.get('dish', 'Food')
-            desc = data.get('desc', 'A delicious and nutritious vegetarian meal.')
-            calories = data.get('calories', 'N/A')
-            meal_key = meal_type.lower()
-            
-            # Get image from curated mapping or fallback to meal-specific placeholder
-            dish_image = get_food_image(dish_name)
-            final_image_url = dish_image if dish_image else MEAL_IMAGES.get(meal_key, MEAL_IMAGES["default"])
-            
-            st.markdown(f"""
-            <div class="food-card">
-                <div class="food-img-container">
-                    <img src="{final_image_url}" class="food-img" alt="{meal_type}">
-                    <span class="meal-badge">{meal_type}</span>
-                </div>
-                <div class="food-details">
-                    <div class="food-title">{dish_name}</div>
-                    <div class="food-desc">{desc}</div>
-                    <div class="food-meta">
-                        <span>🔥 {calories}</span>
-                        <span>🌿 Veg</span>
-                    </div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            if st.button(f"🔄 Swap {meal_type}", key=f"swap_{meal_key}", use_container_width=True):
-                regenerate_single_meal(meal_key, current_menu)
+    # Mounted here too so a swap started from this fragment is polled without a full rerun
+    if has_pending_work():
+        watch_jobs()
     
-    render_card_with_action(c1, "Breakfast", current_menu.get('breakfast', {}))
-    render_card_with_action(c2, "Lunch", current_menu.get('lunch', {}))
-    render_card_with_action(c3, "Dinner", current_menu.get('dinner', {}))
+    # Runs after every swap too, so a slot that was just popped is refilled behind it
+    fill_swap_pool(date_key)
     
-    # --- INGREDIENTS & FOOTER ---
+    # --- INGREDIENTS ---
     st.markdown("<br>", unsafe_allow_html=True)
     
     if current_menu.get('message'):
         st.success(f"**Chef's Note:** {current_menu['message']}")
     
-    if current_menu.get('ingredients'):
-        st.markdown(f"""
-        <div class="ingredients-container">
-            <div class="ing-header">🛒 Ingredients for Today</div>
-            <div>
-                {''.join([f'<span class="pill">{item}</span>' for item in current_menu['ingredients']])}
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+    window_keys = [str(today_ist + datetime.timedelta(days=i)) for i in range(5)]
+    window_plans = {k: st.session_state.meal_plans[k] for k in window_keys if k in st.session_state.meal_plans}
+    day_totals, window_totals = get_nutrition_engine(NUTRITION_CATALOG_VERSION).totals(
+        {**window_plans, date_key: current_menu})
+    if day_totals[date_key]['kcal']:
+        st.markdown(nutrition_html(day_totals[date_key], window_totals, len(day_totals)), unsafe_allow_html=True)
+    
+    todays_ingredients = day_ingredients(current_menu)
+    if todays_ingredients:
+        st.markdown(ingredients_html(todays_ingredients), unsafe_allow_html=True)
+    
+    # Aggregated list for every planned day in the window; only changed meals are recomputed
+    shopping_list = st.session_state.setdefault('shopping_list', ShoppingList())
+    shopping_list.sync(window_plans)
+    shopping_items = shopping_list.items()
+    if shopping_items:
+        with st.expander(f"🧺 Shopping list for the next 5 days ({len(shopping_items)} items)"):
+            st.markdown(
+                ''.join(f'<span class="pill">{name}{f" ×{count}" if count > 1 else ""}</span>' for name, count in shopping_items),
+                unsafe_allow_html=True,
+            )
+
+@st.fragment
+def audio_action(date_key):
+    if st.button("📲 Share Menu as Audio", use_container_width=True):
+        with st.spinner("Generating audio..."):
+            audio_file = text_to_speech(st.session_state.meal_plans[date_key])
+            if audio_file:
+                st.audio(audio_file, format='audio/mp3', start_time=0)
+
+# --- AUTO-GENERATION LOGIC (NO BUTTON) ---
+apply_finished_jobs()
+current_menu = st.session_state.meal_plans.get(selected_date_str)
+if not current_menu:
+    # Reuse a plan another session already paid for, else generate one in the background
+    current_menu = load_stored_plans([selected_date_str]).get(selected_date_str)
+    if current_menu:
+        current_menu = keep_plan(selected_date_str, current_menu)
+
+menu_error = st.session_state.get('job_errors', {}).get((selected_date_str, None))
+shuffle_job = active_job(selected_date_str)
+if menu_error and not current_menu:
+    st.error(menu_error)
+    if st.button("🔁 Try again", use_container_width=True):
+        st.session_state.job_errors.pop((selected_date_str, None), None)
+        rerun()
+elif not current_menu or (shuffle_job and shuffle_job.hedged_plan is None):
+    if shuffle_job is None:
+        start_menu_job("menu", st.session_state.selected_date)
+    elif shuffle_job.kind == "prefetch":
+        promote_prefetch_job(shuffle_job)
+    generation_progress(selected_date_str)
+else:
+    if menu_error:
+        st.error(menu_error)
+        st.session_state.job_errors.pop((selected_date_str, None), None)
+    
+    # --- HEDGED UPGRADE ---
+    # A local plan stands in until Claude's reply has been stored (possibly by another session)
+    if current_menu.get('source') == 'local':
+        stored = load_stored_plans([selected_date_str]).get(selected_date_str)
+        if stored and stored.get('source') != 'local':
+            current_menu = keep_plan(selected_date_str, stored)
+    
+    # --- BACKGROUND PREFETCH OF THE REST OF THE WINDOW ---
+    # Once per preference set, so editing dislikes plans the week again for the new ones
+    client = get_api_client()
+    window_days = [today_ist + datetime.timedelta(days=i) for i in range(5)]
+    prefs_hash = session_prefs_hash()
+    if PREFETCH_ENABLED and client and st.session_state.get('prefetch_started') != prefs_hash:
+        st.session_state.prefetch_started = prefs_hash
+        window_keys = [str(d) for d in window_days]
+        stored = load_stored_plans(window_keys)
+        missing = [d for d in window_days if str(d) not in st.session_state.meal_plans and str(d) not in stored]
+        st.session_state.prefetch_pending = get_prefetcher().start(
+            client, get_plan_store(), st.session_state.preferences, missing, window_keys, get_recent_menus(),
+            st.session_state.household)
+    
+    # Speculatively get the next day in the selector ready while this one is being read
+    next_day = st.session_state.selected_date + datetime.timedelta(days=1)
+    if (PREFETCH_ENABLED and client and next_day in window_days
+            and str(next_day) not in st.session_state.meal_plans and not active_job(str(next_day))
+            and not get_prefetcher().pending(str(next_day), prefs_hash)
+            and not load_stored_plans([str(next_day)]).get(str(next_day))):
+        start_menu_job("prefetch", next_day)
+    
+    menu_grid(selected_date_str)
     
     st.markdown("<br>", unsafe_allow_html=True)
     
     ac1, ac2 = st.columns(2, gap="medium")
     
     with ac1:
-        if st.button("📲 Share Menu as Audio", use_container_width=True):
-            with st.spinner("Generating audio..."):
-                audio_file = text_to_speech(current_menu)
-                if audio_file:
-                    st.audio(audio_file, format='audio/mp3', start_time=0)
+        audio_action(selected_date_str)
     
     with ac2:
         if st.button("🔄 Shuffle Whole Menu", use_container_width=True):
-            menu_data = generate_menu_ai()
-            if menu_data:
-                st.session_state.meal_plans[selected_date_str] = menu_data
-                st.cache_data.clear()
-                st.rerun()
+            start_menu_job("shuffle", st.session_state.selected_date)
+            rerun()
+
+metrics.observe("script_run", time.perf_counter() - SCRIPT_STARTED, "complete")
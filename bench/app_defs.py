@@ -0,0 +1,42 @@
+"""app.py's definitions without its page, for the micro-benchmarks.
+
+app.py is a Streamlit script, so importing it would draw the whole app. This
+runs only its imports, classes, functions and UPPER_CASE constants (plus the
+process-wide metrics they record into) in a fresh module. Relative paths in the
+constants resolve against the working directory, so callers chdir to a scratch
+directory first, as load.py does.
+"""
+import ast
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+
+# Module-level names the definitions use at call time that aren't constants
+RUNTIME_GLOBALS = {"metrics"}
+
+
+def _wanted(node):
+    if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+        return True
+    if isinstance(node, ast.Try):
+        # Optional dependencies (fcntl, PIL) are imported with a fallback
+        return all(isinstance(n, (ast.Import, ast.ImportFrom)) for n in node.body)
+    if isinstance(node, ast.Assign):
+        names = [t.id for t in node.targets if isinstance(t, ast.Name)]
+        return len(names) == len(node.targets) and all(n.isupper() or n in RUNTIME_GLOBALS for n in names)
+    return False
+
+
+def load_app():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), APP_PATH)
+    tree.body = [node for node in tree.body if _wanted(node)]
+    module = types.ModuleType("app_defs.app")
+    module.__file__ = APP_PATH
+    exec(compile(tree, APP_PATH, "exec"), module.__dict__)
+    return module
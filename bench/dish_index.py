@@ -0,0 +1,116 @@
+"""Micro-benchmark for dish-to-image lookup: DishIndex against the linear scan it replaced.
+
+Grows DISH_IMAGE_MAP with made-up regional dish names (real catalog entries
+stay in) and times looking up the names a week of cards shows, including
+misses like "Soya Chaap Masala". Cold lookups skip the LRU memo, so they are
+the indexed lookup's own cost. The index's cost should stay flat as the
+catalog grows, while the old scan grows with it:
+
+    python bench/dish_index.py --sizes 100 1000 10000 50000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app_defs import load_app  # noqa: E402
+from sessions import percentile  # noqa: E402
+
+# Card names as the model writes them: sides after "+", extra words, unknown dishes
+QUERIES = [
+    "Poha", "Aloo Paratha", "Besan Chilla", "Green Beans Poriyal + Rice", "Rajma + Jeera Rice",
+    "Chole + Rice", "Bhindi Masala + Roti", "Dal Makhani + Roti", "Aloo Gobi + Roti", "Kadai Paneer + Roti",
+    "Malai Kofta + Roti", "Soya Chaap Masala + Roti", "Palak Paneer + Roti", "Mixed Dal + Rice",
+    "Methi Thepla", "Sabudana Khichdi", "Punjabi Kadhi Pakoda + Jeera Rice", "Lauki Chana Dal + Roti",
+]
+REGIONS = ["punjabi", "gujarati", "rajasthani", "bengali", "kashmiri", "awadhi", "marwari", "sindhi",
+           "bihari", "malvani", "kolhapuri", "hyderabadi", "lucknowi", "amritsari", "banarasi"]
+STYLES = ["dum", "tadka", "kadai", "handi", "bhuna", "masala", "korma", "jalfrezi", "do pyaza", "makhani",
+          "kofta", "saag", "rasedar", "sukhi", "lababdar", "achari", "kasuri", "hariyali", "shahi", "tawa"]
+BASES = ["aloo", "gobi", "paneer", "bhindi", "baingan", "lauki", "tinda", "arbi", "kathal", "karela",
+         "methi", "palak", "mushroom", "soya", "chana", "rajma", "moong", "urad", "corn", "kaddu"]
+
+
+def grown_catalog(catalog, size, seed=0):
+    """catalog plus made-up "<region> <style> <base>" entries until it holds size keys"""
+    rng = random.Random(seed)
+    grown = dict(catalog)
+    url = next(iter(catalog.values()))
+    while len(grown) < size:
+        name = " ".join([rng.choice(REGIONS), rng.choice(STYLES), rng.choice(BASES), str(rng.randrange(10 ** 6))])
+        grown.setdefault(name, url)
+    return grown
+
+
+def linear_scan(catalog, dish_name):
+    """get_food_image before DishIndex: exact key, else the first key contained either way"""
+    clean_name = dish_name.split('+')[0].strip().lower()
+    if clean_name in catalog:
+        return catalog[clean_name]
+    for key in catalog:
+        if key in clean_name or clean_name in key:
+            return catalog[key]
+    return None
+
+
+def per_lookup(fn, names, repeat):
+    samples = []
+    for name in names:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(name)
+        samples.append((time.perf_counter() - start) / repeat)
+    return {"p50_us": round(percentile(samples, 0.50) * 1e6, 2), "p95_us": round(percentile(samples, 0.95) * 1e6, 2)}
+
+
+def spread(timing):
+    return f"{timing['p50_us']}/{timing['p95_us']}"
+
+
+def run(app, sizes, repeat):
+    results = {}
+    for size in sizes:
+        catalog = grown_catalog(app.DISH_IMAGE_MAP, size)
+        start = time.perf_counter()
+        index = app.DishIndex(catalog)
+        build_ms = round((time.perf_counter() - start) * 1000, 1)
+        keys = [app.catalog_key(q) for q in QUERIES]
+        results[size] = {
+            "build_ms": build_ms,
+            "index_cold": per_lookup(index._lookup, keys, repeat),
+            "index_memo": per_lookup(index.get, QUERIES, repeat),
+            "linear_scan": per_lookup(lambda q: linear_scan(catalog, q), QUERIES, max(1, repeat // 10)),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=200, help="lookups per name when timing")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # The app's metrics log goes to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="ammy-bench-"))
+    app = load_app()
+    # Most specific match wins, whatever the catalog's insertion order
+    index = app.DishIndex({"beans": "beans", "green beans poriyal": "poriyal"})
+    assert index.get("Green Beans Poriyal + Rice") == "poriyal"
+    results = run(app, args.sizes, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'entries':>8} {'build ms':>9} {'index p50/p95 us':>18} {'memo p50/p95 us':>17} {'scan p50/p95 us':>17}")
+    for size, row in results.items():
+        print(f"{size:>8} {row['build_ms']:>9} {spread(row['index_cold']):>18} {spread(row['index_memo']):>17} "
+              f"{spread(row['linear_scan']):>17}")
+
+
+if __name__ == "__main__":
+    main()
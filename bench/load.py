@@ -0,0 +1,101 @@
+"""Headless benchmark and load driver for app.py.
+
+Runs the app through Streamlit's AppTest against bench/mock_claude.py and
+reports cold start, rerun latency (date switch, swap), end-to-end generation
+(shuffle), retained memory per session and behaviour under concurrent sessions.
+AppTest keeps one global runtime per process, so concurrent sessions run in
+worker processes that share the scratch directory (and so the plan store),
+while in-process caches are shared only by sessions in the same worker:
+
+    python bench/load.py --sessions 50 --concurrency 25 --latency 0.8 --error-rate 0.05
+
+The app writes its store, caches and metrics into a scratch directory, so the
+working tree is left alone. Pass --json to get machine-readable results for
+comparing runs.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_claude import add_arguments, config_from, serve  # noqa: E402
+from sessions import Session, measure_memory, run_session, summarize, warm_worker  # noqa: E402
+
+
+ENTRY_MODULE = sys.modules["__main__"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="sessions in the load phase")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions running at once")
+    parser.add_argument("--memory-samples", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60, help="per-rerun AppTest timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, api_url = serve(0, config_from(args))
+    workdir = tempfile.mkdtemp(prefix="ammy-bench-")
+    os.chdir(workdir)
+    results = {"workdir": workdir, "mock": vars(args)}
+
+    cold = Session(api_url, args.timeout)
+    results["cold_start_ms"] = round(cold.open() * 1000, 1)
+    results["warm_start_ms"] = round(Session(api_url, args.timeout).open() * 1000, 1)
+
+    timings = {"open": [], "date_switch": [], "swap": [], "generation": []}
+    errors = []
+    # AppTest leaves the app module installed as __main__; spawned workers would re-run it
+    sys.modules["__main__"] = ENTRY_MODULE
+    with ProcessPoolExecutor(max_workers=args.concurrency, mp_context=get_context("spawn"),
+                             initializer=warm_worker, initargs=(workdir, api_url, args.timeout)) as pool:
+        # Workers finish warm_worker before taking tasks; these short sleeps spread across
+        # them so the clock starts roughly when the whole pool is ready
+        list(pool.map(time.sleep, [0.5] * args.concurrency))
+        wall = time.perf_counter()
+        results_iter = pool.map(run_session, [api_url] * args.sessions,
+                                [args.timeout] * args.sessions, range(args.sessions))
+        for session_timings, session_errors in results_iter:
+            for phase, seconds in session_timings.items():
+                timings[phase].append(seconds)
+            errors.extend(session_errors)
+    wall = time.perf_counter() - wall
+
+    results["load"] = {phase: summarize(samples) for phase, samples in timings.items()}
+    results["load"]["sessions"] = args.sessions
+    results["load"]["concurrency"] = args.concurrency
+    results["load"]["wall_s"] = round(wall, 2)
+    results["load"]["sessions_per_min"] = round(args.sessions / wall * 60, 1)
+    results["load"]["errors"] = len(errors)
+    results["load"]["mock_requests"] = server.RequestHandlerClass.config.requests
+    heap, plans = measure_memory(api_url, args.timeout, args.memory_samples)
+    results["memory_per_session_kb"] = round(heap / 1024, 1)
+    results["plan_state_per_session_kb"] = round(plans / 1024, 2)
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"cold start     {results['cold_start_ms']:>9} ms")
+    print(f"warm start     {results['warm_start_ms']:>9} ms")
+    for phase in timings:
+        row = results["load"][phase]
+        print(f"{phase:<14} p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  max {row['max_ms']} ms  (n={row['count']})")
+    load = results["load"]
+    print(f"{load['sessions']} sessions x {load['concurrency']} concurrent in {load['wall_s']} s "
+          f"({load['sessions_per_min']}/min), {load['errors']} errors, {load['mock_requests']} API calls")
+    print(f"memory/session {results['memory_per_session_kb']:>9} KB "
+          f"(meal plans {results['plan_state_per_session_kb']} KB)")
+    if errors:
+        print("most common error:", statistics.mode(errors)[:300])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Local stand-in for the Claude /v1/messages endpoint.
+
+Answers menu, week, swap and swap-alternative prompts with plausible JSON,
+streaming (SSE) or not, with configurable latency, error rate and
+malformed-JSON rate:
+
+    python bench/mock_claude.py --port 8765 --latency 0.8 --error-rate 0.05 --malformed-rate 0.05
+
+then set CLAUDE_API_URL = "http://127.0.0.1:8765/v1/messages" in .streamlit/secrets.toml.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DISHES = {
+    "breakfast": ["Poha", "Upma", "Aloo Paratha", "Besan Chilla", "Sabudana Khichdi", "Methi Thepla"],
+    "lunch": ["Rajma + Jeera Rice", "Chole + Rice", "Bhindi Masala + Roti", "Dal Makhani + Roti", "Aloo Gobi + Roti"],
+    "dinner": ["Kadai Paneer + Roti", "Malai Kofta + Roti", "Soya Chaap Masala + Roti", "Palak Paneer + Roti", "Mixed Dal + Rice"],
+}
+SEQUENCE = itertools.count(1)
+
+
+class MockConfig:
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, malformed_rate=0.0, chunk_size=12, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def delay(self):
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+
+def meal(meal_type):
+    # A sequence suffix keeps dishes distinct, so the app's no-repeat checks don't trigger re-asks
+    main, *sides = random.choice(DISHES[meal_type]).split(" + ")
+    return {
+        "dish": " + ".join([f"{main} {next(SEQUENCE)}", *sides]),
+        "desc": "A comforting home-style dish with fresh spices and a little ghee.",
+    }
+
+
+def day_menu():
+    menu = {meal_type: meal(meal_type) for meal_type in DISHES}
+    menu["message"] = "Soak the rajma overnight for a creamier gravy."
+    return menu
+
+
+def reply_text(prompt):
+    wanted = re.search(r"Alternatives wanted: (\d+) each for ([a-z, ]+)\.", prompt)
+    if wanted:
+        count, meal_types = int(wanted.group(1)), wanted.group(2).split(", ")
+        return json.dumps({meal_type: [meal(meal_type) for _ in range(count)] for meal_type in meal_types})
+    if "Meal to replace:" in prompt:
+        meal_type = prompt.split("Meal to replace:", 1)[1].split()[0]
+        return json.dumps({meal_type: meal(meal_type)})
+    days = re.findall(r"^- (\d{4}-\d{2}-\d{2}):", prompt, re.MULTILINE)
+    if days:
+        return "Here is the week:\n" + json.dumps({day: day_menu() for day in days})
+    return "Here is today's menu:\n" + json.dumps(day_menu())
+
+
+def prompt_of(payload):
+    content = payload.get("messages", [{}])[-1].get("content", "")
+    if isinstance(content, list):
+        content = " ".join(block.get("text", "") for block in content)
+    return content
+
+
+class Handler(BaseHTTPRequestHandler):
+    config = MockConfig()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(config.delay())
+
+        if config.roll(config.error_rate):
+            status = random.choice([429, 500, 529])
+            headers = {"retry-after": "1"} if status in (429, 529) else {}
+            return self.send_json(status, {"type": "error", "error": {"type": "mock_error", "message": "injected"}}, headers)
+
+        text = reply_text(prompt_of(payload))
+        if config.roll(config.malformed_rate):
+            text = text[: len(text) * 2 // 3]
+        usage = {"input_tokens": len(prompt_of(payload)) // 4, "output_tokens": len(text) // 4}
+
+        if not payload.get("stream"):
+            return self.send_json(200, {
+                "type": "message", "model": payload.get("model"), "role": "assistant",
+                "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        events = [("message_start", {"type": "message_start", "message": {"usage": {"input_tokens": usage["input_tokens"], "output_tokens": 1}}})]
+        for i in range(0, len(text), config.chunk_size):
+            events.append(("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                   "delta": {"type": "text_delta", "text": text[i:i + config.chunk_size]}}))
+        events.append(("message_delta", {"type": "message_delta", "usage": {"output_tokens": usage["output_tokens"]}}))
+        events.append(("message_stop", {"type": "message_stop"}))
+        per_chunk = config.delay() / max(len(events), 1) / 4
+        for name, data in events:
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(per_chunk)
+
+
+def serve(port=0, config=None):
+    """Start the stand-in on a daemon thread; returns (server, url)"""
+    handler = type("ConfiguredHandler", (Handler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/messages"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.5, help="mean seconds before the reply starts")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 429/500/529")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of replies with truncated JSON")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from(args):
+    return MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      malformed_rate=args.malformed_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, url = serve(args.port, config_from(args))
+    print(f"Mock Claude listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
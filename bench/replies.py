@@ -0,0 +1,113 @@
+"""Micro-benchmark for reply parsing: extract_json, its repair step and validate_menu.
+
+Feeds every sample in bench/replies.jsonl (clean, wrapped in prose or code
+fences, smart quotes as delimiters or inside values, trailing commas, braces
+in prose) through the app's
+parse_menu and through the greedy regex it replaced. Each complete reply is
+also cut off at every comma and inside every word, as a reply stopped by
+max_tokens would be. For each kind it reports how many replies became a menu,
+how many the old regex would have sent back for a full re-generation, how many
+accepted menus hold a half-written dish (should be 0) and the time per parse:
+
+    python bench/replies.py --repeat 200
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app_defs import load_app  # noqa: E402
+from sessions import percentile  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replies.jsonl")
+MEAL_TYPES = ("breakfast", "lunch", "dinner")
+
+
+def greedy_regex(text):
+    """extract_json before the scanner"""
+    try:
+        match = re.search(r'\{.*\}', text, re.DOTALL)
+        if match:
+            return json.loads(match.group())
+        return json.loads(text)
+    except Exception:
+        return None
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def truncations(text):
+    """text cut after every comma and halfway through every word, like a reply stopped at max_tokens"""
+    start = text.find("{")
+    cuts = {m.end() for m in re.finditer(r",", text)}
+    cuts |= {m.start() + len(m.group()) // 2 for m in re.finditer(r"[A-Za-z]{2,}", text)}
+    return [text[:cut] for cut in sorted(cuts) if start < cut < len(text) - 1]
+
+
+def expand(corpus):
+    """(kind, text, dishes the full reply holds) for every sample and every truncation of a parseable one"""
+    samples = []
+    for row in corpus:
+        samples.append((row["kind"], row["text"], None))
+        full = greedy_regex(row["text"]) or greedy_regex(row["text"].translate(str.maketrans("“”", '""')))
+        if row["kind"] == "clean" and full:
+            dishes = {full[m]["dish"] for m in MEAL_TYPES}
+            samples.extend(("truncated", text, dishes) for text in truncations(row["text"]))
+    return samples
+
+
+def run(app, samples, repeat):
+    report = defaultdict(lambda: {"replies": 0, "menus": 0, "regex_menus": 0, "retries_avoided": 0,
+                                  "half_written_dishes": 0, "times": []})
+    for kind, text, dishes in samples:
+        row = report[kind]
+        row["replies"] += 1
+        start = time.perf_counter()
+        for _ in range(repeat):
+            menu = app.parse_menu(text)
+        row["times"].append((time.perf_counter() - start) / repeat)
+        before = app.validate_menu(greedy_regex(text))
+        row["menus"] += menu is not None
+        row["regex_menus"] += before is not None
+        row["retries_avoided"] += menu is not None and before is None
+        if menu is not None and dishes is not None:
+            row["half_written_dishes"] += sum(menu[m]["dish"] not in dishes for m in MEAL_TYPES)
+    results = {}
+    for kind, row in report.items():
+        times = row.pop("times")
+        results[kind] = {**row, "p50_us": round(percentile(times, 0.50) * 1e6, 1),
+                         "p95_us": round(percentile(times, 0.95) * 1e6, 1)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS, help="JSONL of {kind, text} replies")
+    parser.add_argument("--repeat", type=int, default=100, help="parses per reply when timing")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    samples = expand(load_corpus(args.corpus))
+    # The app's metrics log goes to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="ammy-bench-"))
+    results = run(load_app(), samples, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = ["replies", "menus", "regex_menus", "retries_avoided", "half_written_dishes", "p50_us", "p95_us"]
+    print(f"{'kind':<16}" + "".join(f"{c:>20}" for c in columns))
+    for kind, row in results.items():
+        print(f"{kind:<16}" + "".join(f"{row[c]:>20}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
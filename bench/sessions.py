@@ -0,0 +1,141 @@
+"""Session driver shared by bench/load.py and its worker processes.
+
+Kept out of load.py because AppTest swaps out sys.modules["__main__"] while a
+script runs, so functions defined in the entry script can't be pickled for the
+process pool.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+from streamlit.testing.v1 import AppTest
+
+# Generation runs as background jobs, so an action is timed until the page settles
+SETTLE_POLL_S = 0.1
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))] if ordered else None
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 1) if samples else None,
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 1) if samples else None,
+        "max_ms": round(max(samples) * 1000, 1) if samples else None,
+    }
+
+
+class Session:
+    """One browser tab: an AppTest that remembers its own widget state between reruns"""
+
+    def __init__(self, api_url, timeout):
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.at.secrets["CLAUDE_API_KEY"] = "bench"
+        self.at.secrets["CLAUDE_API_URL"] = api_url
+        self.timeout = timeout
+        self.errors = []
+
+    def settled(self):
+        """All three cards drawn and no swap or shuffle in flight (a browser would be polling)"""
+        cards = sum('class="food-title"' in m.value for m in self.at.markdown)
+        return cards == 3 and not any(b.label.startswith("✖") for b in self.at.button)
+
+    def timed(self, action):
+        start = time.perf_counter()
+        action()
+        while not self.at.exception and not self.settled() and time.perf_counter() - start < self.timeout:
+            time.sleep(SETTLE_POLL_S)
+            self.at.run()
+        elapsed = time.perf_counter() - start
+        if self.at.exception:
+            self.errors.extend(e.value for e in self.at.exception)
+        elif not self.settled():
+            self.errors.append("page did not settle")
+        return elapsed
+
+    def open(self):
+        return self.timed(self.at.run)
+
+    def switch_date(self, index):
+        dates = [b for b in self.at.button if "\n" in b.label]
+        return self.timed(lambda: dates[index % len(dates)].click().run())
+
+    def swap(self, meal_type="lunch"):
+        return self.timed(lambda: self.at.button(key=f"swap_{meal_type}").click().run())
+
+    def fill_window(self):
+        """Poll until every day of the window is in the session, as an open tab would"""
+        start = time.perf_counter()
+        while len(self.at.session_state["meal_plans"]) < 5 and time.perf_counter() - start < self.timeout:
+            time.sleep(SETTLE_POLL_S * 5)
+            self.at.run()
+
+    def shuffle(self):
+        button = next(b for b in self.at.button if "Shuffle" in b.label)
+        return self.timed(lambda: button.click().run())
+
+
+def warm_worker(workdir, api_url, timeout):
+    """Pay the import and first-run cost before the worker takes timed sessions"""
+    os.chdir(workdir)
+    Session(api_url, timeout).open()
+
+
+def run_session(api_url, timeout, index):
+    session = Session(api_url, timeout)
+    timings = {"open": session.open()}
+    if not session.errors:
+        timings["date_switch"] = session.switch_date(index + 1)
+        timings["swap"] = session.swap()
+        timings["generation"] = session.shuffle()
+    return timings, session.errors
+
+
+def deep_size(obj, seen):
+    """Bytes reachable from obj and not yet in seen, so objects shared between sessions count once"""
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        else:
+            for cls in type(item).__mro__:
+                stack.extend(getattr(item, name) for name in cls.__dict__.get("__slots__", ()) if hasattr(item, name))
+            if hasattr(item, "__dict__"):
+                stack.append(item.__dict__)
+    return total
+
+
+def measure_memory(api_url, timeout, samples):
+    """Per open session: Python heap retained, and bytes held by its meal plans alone"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = []
+    for i in range(samples):
+        session = Session(api_url, timeout)
+        session.open()
+        session.switch_date(i + 1)
+        session.fill_window()
+        kept.append(session)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # Each AppTest compiles its own copy of the script; a server compiles it once for every session
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename")
+                   if not stat.traceback[0].filename.endswith("script_cache.py"))
+    seen = set()
+    plans = sum(deep_size(session.at.session_state["meal_plans"], seen) for session in kept)
+    return retained / max(samples, 1), plans / max(samples, 1)
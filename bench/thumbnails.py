@@ -0,0 +1,147 @@
+"""Check and time ImageCache thumbnails built from a local file:// image source.
+
+Writes catalog-sized source images (the ?w=800 photos and larger, in several
+aspect ratios) into a scratch folder. Then it drives ImageCache the way cards
+do, so no network is touched:
+- the first url_for serves the source while a thumbnail is made in the background
+- later calls serve the local thumbnail, cover-cropped to THUMB_SIZE
+- prewarm covers a whole catalog
+- a missing source leaves nothing behind
+- eviction holds the directory to its byte budget
+
+Any failed check exits non-zero:
+
+    python bench/thumbnails.py --images 40
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app_defs import load_app  # noqa: E402
+
+# (width, height) of source photos: Unsplash's w=800 crops, portrait shots and camera originals
+SOURCE_SIZES = [(800, 533), (800, 1200), (1600, 900), (2400, 1600), (640, 360), (300, 200)]
+URL_PREFIX = "app/static/thumbs/"
+
+
+def write_sources(Image, directory, count):
+    """count JPEG photos with some detail, so sizes resemble real ones; returns their file:// URLs"""
+    sources = []
+    for i in range(count):
+        width, height = SOURCE_SIZES[i % len(SOURCE_SIZES)]
+        image = Image.effect_noise((width, height), 40 + i % 30).convert("RGB")
+        path = os.path.join(directory, f"dish-{i}.jpg")
+        image.save(path, "JPEG", quality=85)
+        sources.append("file://" + path)
+    return sources
+
+
+def wait_for(cache, sources, timeout):
+    start = time.perf_counter()
+    pending = set(sources)
+    while pending and time.perf_counter() - start < timeout:
+        pending = {s for s in pending if not os.path.exists(os.path.join(cache.directory, cache._name(s)))}
+        time.sleep(0.01)
+    return time.perf_counter() - start, pending
+
+
+def check(failures, ok, message):
+    if not ok:
+        failures.append(message)
+
+
+def run(app, workdir, count, timeout):
+    Image = app.Image
+    failures = []
+    sources = write_sources(Image, os.path.join(workdir, "sources"), count)
+    cache = app.ImageCache(os.path.join(workdir, "thumbs"), URL_PREFIX)
+
+    # A card's first view: the source stands in while the thumbnail is made
+    first = sources[0]
+    check(failures, cache.url_for(first) == first, "first url_for should serve the source")
+    _, pending = wait_for(cache, [first], timeout)
+    check(failures, not pending, "thumbnail for the first source was never written")
+    check(failures, cache.url_for(first) == URL_PREFIX + cache._name(first), "second url_for should be local")
+
+    # Prewarm the catalog, as get_image_cache does at startup
+    cache.prewarm(sources + sources[:3])
+    elapsed, pending = wait_for(cache, sources, timeout)
+    check(failures, not pending, f"{len(pending)} thumbnails missing after prewarm")
+
+    source_bytes, thumb_bytes = 0, 0
+    for source in sources:
+        path = os.path.join(cache.directory, cache._name(source))
+        if not os.path.exists(path):
+            continue
+        source_bytes += os.path.getsize(source[len("file://"):])
+        thumb_bytes += os.path.getsize(path)
+        with Image.open(path) as thumb:
+            check(failures, thumb.size == cache.size, f"{os.path.basename(source)}: thumbnail is {thumb.size}")
+            check(failures, thumb.format == cache.format, f"{os.path.basename(source)}: stored as {thumb.format}")
+
+    # A source that can't be read is skipped without leaving a file or an in-flight entry
+    missing = "file://" + os.path.join(workdir, "sources", "missing.jpg")
+    cache.url_for(missing)
+    time.sleep(0.2)
+    check(failures, not os.path.exists(os.path.join(cache.directory, cache._name(missing))),
+          "a missing source left a thumbnail behind")
+    check(failures, missing not in cache._inflight, "a missing source stayed in flight")
+
+    # Eviction keeps the directory within budget, dropping least recently used thumbnails first
+    budget = max(thumb_bytes // 4, 1)
+    small = app.ImageCache(os.path.join(workdir, "thumbs-small"), URL_PREFIX, max_bytes=budget)
+    small.prewarm(sources)
+    wait_for(small, sources[-1:], timeout)
+    time.sleep(0.2)
+    held = sum(e.stat().st_size for e in os.scandir(small.directory) if e.name.endswith(small.suffixes))
+    largest = max((os.path.getsize(os.path.join(cache.directory, cache._name(s))) for s in sources), default=0)
+    check(failures, held <= budget + largest, f"evicting cache holds {held} bytes for a {budget} byte budget")
+
+    return {
+        "images": len(sources),
+        "format": cache.format,
+        "thumb_size": list(cache.size),
+        "prewarm_s": round(elapsed, 3),
+        "per_image_ms": round(elapsed / max(len(sources), 1) * 1000, 1),
+        "source_kb": round(source_bytes / 1024, 1),
+        "thumb_kb": round(thumb_bytes / 1024, 1),
+        "bytes_saved_pct": round(100 * (1 - thumb_bytes / source_bytes), 1) if source_bytes else None,
+        "evicting_cache_kb": round(held / 1024, 1),
+        "evicting_budget_kb": round(budget / 1024, 1),
+        "failures": failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=24, help="source images to generate")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for thumbnails")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ammy-bench-")
+    os.makedirs(os.path.join(workdir, "sources"))
+    # The app's metrics log goes to the working directory
+    os.chdir(workdir)
+    app = load_app()
+    if app.Image is None:
+        sys.exit("Pillow is not installed, so the app serves remote images and makes no thumbnails")
+    results = run(app, workdir, max(args.images, 1), args.timeout)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            if name != "failures":
+                print(f"{name:>20}: {value}")
+        for failure in results["failures"]:
+            print(f"FAIL: {failure}")
+    sys.exit(1 if results["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
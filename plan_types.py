@@ -0,0 +1,96 @@
+"""Compact meal plans for session state.
+
+Streamlit re-executes app.py in a fresh module on every rerun, so classes
+defined there would differ from run to run, and every plan kept in a session
+would pin the namespace of the run that made it. Defined here, they are
+imported once per process.
+"""
+import sys
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Optional
+
+MEAL_TYPES = ("breakfast", "lunch", "dinner")
+
+
+class CompactRecord(Mapping):
+    """Read-only dict view over a slotted dataclass: unset (None) fields are absent keys.
+
+    Lets cards, prompts and checks take a compact plan or the dict it came from,
+    and json.dumps(record, default=dict) writes the same JSON the dict would.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return list(value) if isinstance(value, tuple) else value
+
+    def __iter__(self):
+        return (name for name in self.__slots__ if getattr(self, name) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def interned(text):
+    return sys.intern(str(text)) if text is not None else None
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Meal(CompactRecord):
+    dish: str
+    desc: Optional[str] = None
+    ingredients: Optional[tuple] = None
+    calories: Optional[str] = None  # Model estimate on plans stored before local nutrition
+
+    @classmethod
+    def from_dict(cls, meal):
+        ingredients = meal.get('ingredients')
+        return cls(
+            interned(meal['dish']),
+            interned(meal.get('desc')),
+            tuple(interned(i) for i in ingredients) if isinstance(ingredients, (list, tuple)) else None,
+            interned(meal.get('calories')),
+        )
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class DayPlan(CompactRecord):
+    """One day's menu as a session holds it.
+
+    Sessions showing the same stored plan share its dish, description and
+    ingredient strings through sys.intern instead of each keeping a copy.
+    """
+
+    breakfast: Optional[Meal] = None
+    lunch: Optional[Meal] = None
+    dinner: Optional[Meal] = None
+    message: Optional[str] = None
+    ingredients: Optional[tuple] = None
+    source: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, plan):
+        meals = {}
+        for meal_type in MEAL_TYPES:
+            meal = plan.get(meal_type)
+            if isinstance(meal, Meal):
+                meals[meal_type] = meal
+            elif isinstance(meal, Mapping) and meal.get('dish'):
+                meals[meal_type] = Meal.from_dict(meal)
+        ingredients = plan.get('ingredients')
+        return cls(
+            **meals,
+            message=interned(plan.get('message')),
+            ingredients=tuple(interned(i) for i in ingredients) if isinstance(ingredients, (list, tuple)) else None,
+            source=interned(plan.get('source')),
+        )
+
+
+def compact_plan(plan):
+    if plan is None or isinstance(plan, DayPlan):
+        return plan
+    return DayPlan.from_dict(plan)